@@ -1,56 +1,165 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
+import json
+import multiprocessing
 import os
+import shutil
+import sys
+import typing
 
-from aws_cdk import (
-    core,
-)
-
-import infra.network
-import infra.cluster_users
-import infra.eks
+import yaml
 
 # Config
 
-name = os.getenv('ENV_NAME', 'mytest')
-cluster_name = name
-tags = {
-    'Team': 'kubebois'
-}
-cluster_version = '1.14'
-env = core.Environment(
-    account=os.getenv('CDK_DEFAULT_ACCOUNT'), # if not set, CDK will not detect all available AZs
-    region=os.getenv('CDK_DEFAULT_REGION', 'eu-central-1')
-)
+_root = os.path.dirname(os.path.abspath(__file__))
+config_path = os.getenv('CLUSTERS_CONFIG', os.path.join(_root, 'clusters.yaml'))
+outdir = os.getenv('CDK_OUTDIR', 'cdk.out')
+
+def load_config(path: str) -> typing.List[dict]:
+    with open(path) as fp:
+        config = yaml.safe_load(fp) or {}
+    defaults = config.get('defaults') or {}
+    clusters = []
+    for cluster in config.get('clusters') or []:
+        cluster = dict(defaults, **cluster)
+        cluster['tags'] = dict(defaults.get('tags') or {}, **(cluster.get('tags') or {}))
+        cluster.setdefault('cluster_name', cluster['name'])
+        clusters.append(cluster)
+    return clusters
+
+def selected_clusters() -> typing.Optional[typing.Set[str]]:
+    # Clusters can be selected with `cdk synth -c clusters=a,b` or with the
+    # CLUSTERS environment variable.
+    context = json.loads(os.getenv('CDK_CONTEXT_JSON') or '{}')
+    selection = context.get('clusters') or os.getenv('CLUSTERS')
+    if not selection:
+        return None
+    return {name.strip() for name in selection.split(',') if name.strip()}
 
 # Stacks
 
-app = core.App()
-network_stack = infra.network.EksNetworkStack(
-    scope=app,
-    id=name + '-network',
-    cidr_id=100,
-    cluster_name=cluster_name,
-    env=env,
-    tags=tags,
-)
-cluster_stack = infra.eks.EksStack(
-    scope=app,
-    id=name + '-eks',
-    cluster_name=cluster_name,
-    cluster_version=cluster_version,
-    vpc=network_stack.vpc,
-    env=env,
-    tags=tags,
-)
-cluster_users_stack = infra.cluster_users.EksClusterUsersStack(
-    scope=app,
-    id=name + '-users',
-    clusters=[cluster_stack.cluster],
-    env=env,
-    tags=tags,
-)
+def synth_environment(config: dict, assembly_dir: str) -> str:
+    # The CDK is imported here rather than at the top, because every worker
+    # process needs its own jsii runtime.
+    from aws_cdk import core
+
+    import eks_worker
+    import infra.network
+    import infra.cluster_users
+    import infra.eks
+
+    name = config['name']
+    env = core.Environment(
+        account=config.get('account') or os.getenv('CDK_DEFAULT_ACCOUNT'), # if not set, CDK will not detect all available AZs
+        region=config.get('region') or os.getenv('CDK_DEFAULT_REGION', 'eu-central-1'),
+    )
+
+    app = core.App(outdir=assembly_dir)
+    network_stack = infra.network.EksNetworkStack(
+        scope=app,
+        id=name + '-network',
+        cidr_id=config['cidr_id'],
+        cluster_name=config['cluster_name'],
+        env=env,
+        tags=config['tags'],
+    )
+    cluster_stack = infra.eks.EksStack(
+        scope=app,
+        id=name + '-eks',
+        cluster_name=config['cluster_name'],
+        cluster_version=config['cluster_version'],
+        vpc=network_stack.vpc,
+        node_pools=[eks_worker.node_pool_from_config(pool) for pool in config.get('node_pools') or []],
+        env=env,
+        tags=config['tags'],
+    )
+    cluster_users_stack = infra.cluster_users.EksClusterUsersStack(
+        scope=app,
+        id=name + '-users',
+        clusters=[cluster_stack.cluster],
+        env=env,
+        tags=config['tags'],
+    )
+    app.synth()
+    return assembly_dir
 
 # Synthesize!
 
-app.synth()
+def synth_all(
+    clusters: typing.List[dict],
+    outdir: str,
+    workers: typing.Optional[int]=None,
+) -> None:
+    # Every environment is synthesized into its own cloud assembly in a
+    # separate process. The assemblies are then merged into outdir, which is
+    # what the CDK CLI reads.
+    staging_dir = os.path.join(outdir, 'clusters')
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    # jsii does not survive a fork, so workers are always started fresh.
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers or min(len(clusters), os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+    with executor:
+        assembly_dirs = list(executor.map(
+            synth_environment,
+            clusters,
+            [os.path.join(staging_dir, c['name']) for c in clusters],
+        ))
+
+    _merge_assemblies(assembly_dirs, outdir)
+    shutil.rmtree(staging_dir)
+
+def _merge_assemblies(assembly_dirs: typing.List[str], outdir: str) -> None:
+    manifest = None
+    for assembly_dir in assembly_dirs:
+        with open(os.path.join(assembly_dir, 'manifest.json')) as fp:
+            assembly = json.load(fp)
+        if manifest is None:
+            manifest = dict(assembly, artifacts={}, missing=[])
+
+        # The construct tree is per app and cannot be merged, so it is left out.
+        artifacts = {
+            artifact_id: artifact
+            for artifact_id, artifact in assembly.get('artifacts', {}).items()
+            if artifact.get('type') != 'cdk:tree'
+        }
+        manifest['artifacts'].update(artifacts)
+        for missing in assembly.get('missing', []):
+            if missing not in manifest['missing']:
+                manifest['missing'].append(missing)
+
+        # Templates are named after their stacks and assets after their
+        # content, so files from different assemblies do not collide.
+        for entry in os.listdir(assembly_dir):
+            if entry in ('manifest.json', 'tree.json'):
+                continue
+            target = os.path.join(outdir, entry)
+            if os.path.isdir(target):
+                continue
+            os.replace(os.path.join(assembly_dir, entry), target)
+
+    if not manifest['missing']:
+        del manifest['missing']
+    with open(os.path.join(outdir, 'manifest.json'), 'w') as fp:
+        json.dump(manifest, fp, indent=2)
+
+def main() -> None:
+    clusters = load_config(config_path)
+    selection = selected_clusters()
+    if selection is not None:
+        unknown = selection - {c['name'] for c in clusters}
+        if unknown:
+            sys.exit('Unknown clusters in selection: %s' % ', '.join(sorted(unknown)))
+        clusters = [c for c in clusters if c['name'] in selection]
+    if not clusters:
+        sys.exit('No clusters to synthesize in %s' % config_path)
+
+    workers = os.getenv('SYNTH_WORKERS')
+    synth_all(clusters, outdir, int(workers) if workers else None)
+
+if __name__ == '__main__':
+    main()
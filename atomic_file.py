@@ -0,0 +1,25 @@
+import os
+import tempfile
+import typing
+
+def write(path: str, content: typing.Union[str, bytes], mode: typing.Optional[int]=None) -> None:
+    # The content is written to a temporary file next to the target and moved
+    # into place, so readers never see a partial file. The temporary file is
+    # removed if anything fails on the way.
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # NamedTemporaryFile creates the file readable by the owner only, unless
+    # a mode is given.
+    fp = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+    try:
+        fp.write(content)
+        fp.close()
+        if mode is not None:
+            os.chmod(fp.name, mode)
+        os.replace(fp.name, path)
+    except BaseException:
+        fp.close()
+        os.unlink(fp.name)
+        raise
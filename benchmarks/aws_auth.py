@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+import typing
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+sys.path.insert(0, _root)
+from benchmarks import fakes
+
+# (roles, clusters)
+_discovery_scenarios = [(1000, 1), (1000, 50), (10000, 50), (50000, 200)]
+_update_scenarios = [(1000, 1), (1000, 50), (10000, 200)]
+_quick_limit = 10000
+# Short runs are noisy, so wall time gets some absolute slack on top of the
+# relative tolerance.
+_wall_time_slack = 0.25
+
+def load_update_aws_auth():
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    spec = importlib.util.spec_from_file_location(
+        'update_aws_auth',
+        os.path.join(_root, 'update-aws-auth.py'),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def measure(setup: typing.Callable[[], typing.Callable[[], int]]) -> dict:
+    # Wall time and peak memory come from separate runs, so that the tracing
+    # overhead of tracemalloc does not skew the timing.
+    run = setup()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        api_calls = run()
+    wall = time.perf_counter() - start
+
+    run = setup()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_seconds': round(wall, 4),
+        'api_calls': api_calls,
+        'peak_memory_bytes': peak,
+    }
+
+def discovery_benchmark(module, roles: int, clusters: int, bulk: bool, latency: float):
+    def setup():
+        iam = fakes.FakeIam(roles, clusters, latency=latency)
+
+        def run() -> int:
+            if bulk:
+                module.generate_role_mappings_bulk('123456789012', module.fetch_roles_with_tags(iam))
+            else:
+                module.generate_role_mappings('123456789012', module.fetch_roles(iam), 10, iam)
+            return sum(iam.calls.values())
+        return run
+    return setup
+
+def update_benchmark(module, roles: int, clusters: int, steady: bool):
+    import kubernetes
+
+    iam = fakes.FakeIam(roles, clusters)
+    role_mappings = module.generate_role_mappings_bulk(
+        '123456789012',
+        module.fetch_roles_with_tags(iam),
+    )
+
+    def setup():
+        kube = fakes.FakeKubernetes().__enter__()
+        api_clients = {}
+
+        def connect(cluster: str) -> kubernetes.client.ApiClient:
+            if cluster not in api_clients:
+                conf = kubernetes.client.Configuration()
+                conf.host = kube.host(cluster)
+                api_clients[cluster] = kubernetes.client.ApiClient(conf)
+            return api_clients[cluster]
+
+        if steady:
+            with contextlib.redirect_stdout(io.StringIO()):
+                module.update_aws_auth(role_mappings, connect=connect)
+            kube.requests.clear()
+
+        def run() -> int:
+            try:
+                results = module.update_aws_auth(role_mappings, connect=connect)
+            finally:
+                kube.__exit__()
+            errors = [r.error for r in results if r.error is not None]
+            if errors:
+                raise errors[0]
+            return sum(kube.requests.values())
+        return run
+    return setup
+
+def run_benchmarks(quick: bool, latency: float) -> dict:
+    module = load_update_aws_auth()
+    results = {}
+    for roles, clusters in _discovery_scenarios:
+        if quick and roles > _quick_limit:
+            continue
+        for bulk in (False, True):
+            name = 'discovery-%s-%droles-%dclusters' % ('bulk' if bulk else 'per-role', roles, clusters)
+            results[name] = measure(discovery_benchmark(module, roles, clusters, bulk, latency))
+            print(name, results[name])
+    for roles, clusters in _update_scenarios:
+        if quick and roles > _quick_limit:
+            continue
+        for steady in (False, True):
+            name = 'update-%s-%droles-%dclusters' % ('steady' if steady else 'initial', roles, clusters)
+            results[name] = measure(update_benchmark(module, roles, clusters, steady))
+            print(name, results[name])
+    return results
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> typing.List[str]:
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['api_calls'] > expected['api_calls']:
+            regressions.append('%s: %d API calls, baseline %d' % (
+                name, result['api_calls'], expected['api_calls'],
+            ))
+        if result['wall_seconds'] > expected['wall_seconds'] * tolerance + _wall_time_slack:
+            regressions.append('%s: %.3fs wall time, baseline %.3fs' % (
+                name, result['wall_seconds'], expected['wall_seconds'],
+            ))
+        if result['peak_memory_bytes'] > expected['peak_memory_bytes'] * tolerance:
+            regressions.append('%s: %d bytes peak memory, baseline %d' % (
+                name, result['peak_memory_bytes'], expected['peak_memory_bytes'],
+            ))
+    return regressions
+
+def main() -> None:
+    aparser = argparse.ArgumentParser(
+        description='Benchmark update-aws-auth.py against stubbed IAM and Kubernetes APIs',
+    )
+    aparser.add_argument(
+        '--quick',
+        dest='quick',
+        action='store_true',
+        help='Skip the largest scenarios',
+    )
+    aparser.add_argument(
+        '--latency',
+        dest='latency',
+        type=float,
+        default=0.0,
+        help='Simulated IAM call latency in seconds',
+    )
+    aparser.add_argument(
+        '--baseline',
+        dest='baseline',
+        default=_default_baseline,
+        help='Baseline file to compare against',
+    )
+    aparser.add_argument(
+        '--tolerance',
+        dest='tolerance',
+        type=float,
+        default=1.5,
+        help='Allowed slowdown/memory growth factor relative to the baseline',
+    )
+    aparser.add_argument(
+        '--write-baseline',
+        dest='write_baseline',
+        action='store_true',
+        help='Store the results as the new baseline',
+    )
+    args = aparser.parse_args()
+
+    results = run_benchmarks(args.quick, args.latency)
+    if args.write_baseline:
+        with open(args.baseline, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+        return
+
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import collections
+import http.server
+import json
+import socketserver
+import threading
+import time
+import typing
+
+# Synthetic IAM account with `role_count` roles under /eks/. Every role is
+# bound to `bindings_per_role` clusters, alternating between the compact and
+# the per-cluster tag formats. Only the calls update-aws-auth.py makes are
+# implemented.
+class FakeIam:
+    def __init__(
+        self,
+        role_count: int,
+        cluster_count: int,
+        bindings_per_role: int=2,
+        latency: float=0.0,
+    ) -> None:
+        self.latency = latency
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+        self.clusters = ['cluster-%d' % i for i in range(cluster_count)]
+        self.roles = []
+        self.tags = {}
+        for i in range(role_count):
+            name = 'role-%d' % i
+            self.roles.append({
+                'Path': '/eks/',
+                'RoleName': name,
+                'RoleId': 'AROA%016d' % i,
+                'Arn': 'arn:aws:iam::123456789012:role/eks/%s' % name,
+            })
+            clusters = [
+                self.clusters[(i + j) % cluster_count]
+                for j in range(min(bindings_per_role, cluster_count))
+            ]
+            self.tags[name] = _role_tags(i, clusters)
+
+    def get_paginator(self, operation: str):
+        return _FakePaginator(self, operation)
+
+    def list_role_tags(self, RoleName: str, MaxItems: int=100, Marker: typing.Optional[str]=None) -> dict:
+        self._call('ListRoleTags')
+        start = int(Marker or 0)
+        tags = self.tags[RoleName]
+        page = tags[start:start + MaxItems]
+        output = {'Tags': page, 'IsTruncated': start + MaxItems < len(tags)}
+        if output['IsTruncated']:
+            output['Marker'] = str(start + MaxItems)
+        return output
+
+    def _call(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+class _FakePaginator:
+    def __init__(self, iam: FakeIam, operation: str) -> None:
+        self._iam = iam
+        self._operation = operation
+
+    def paginate(self, **kwargs):
+        for start in range(0, len(self._iam.roles), 1000):
+            roles = self._iam.roles[start:start + 1000]
+            if self._operation == 'list_roles':
+                self._iam._call('ListRoles')
+                yield {'Roles': roles}
+            elif self._operation == 'get_account_authorization_details':
+                self._iam._call('GetAccountAuthorizationDetails')
+                yield {
+                    'RoleDetailList': [
+                        dict(role, Tags=self._iam.tags[role['RoleName']])
+                        for role in roles
+                    ],
+                }
+            else:
+                raise NotImplementedError(self._operation)
+
+def _role_tags(index: int, clusters: typing.List[str]) -> typing.List[dict]:
+    if index % 3 == 0:
+        return [{'Key': 'eks-node/clusters', 'Value': ' '.join(clusters)}]
+    if index % 3 == 1:
+        return [
+            {'Key': 'eks-user/username', 'Value': 'user-%d' % index},
+            {'Key': 'eks-user/groups', 'Value': 'team-%d' % (index % 10)},
+            {'Key': 'eks-user/clusters', 'Value': ' '.join(clusters)},
+        ]
+    tags = []
+    for cluster in clusters:
+        tags.extend([
+            {'Key': 'eks/%s/type' % cluster, 'Value': 'user'},
+            {'Key': 'eks/%s/username' % cluster, 'Value': 'user-%d' % index},
+            {'Key': 'eks/%s/groups' % cluster, 'Value': 'team-%d' % (index % 10)},
+        ])
+    return tags
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+# Local stand-in for the Kubernetes API servers of many clusters. Requests are
+# routed by a /clusters/<name> prefix, and only the aws-auth ConfigMap calls
+# used by update-aws-auth.py are served.
+class FakeKubernetes:
+    def __init__(self) -> None:
+        self.requests = collections.Counter()
+        self.config_maps = {}
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.port = self._server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def host(self, cluster: str) -> str:
+        return 'http://127.0.0.1:%d/clusters/%s' % (self.port, cluster)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_PATCH(self):
+                self._handle('PATCH')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def _handle(self, method: str) -> None:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'null')
+                parts = self.path.split('/')
+                # /clusters/<name>/api/v1/namespaces/kube-system/configmaps[/aws-auth]
+                cluster = parts[2]
+                with fake._lock:
+                    fake.requests[method] += 1
+                    status, response = fake._serve(method, cluster, parts[3:], body)
+                payload = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _serve(self, method: str, cluster: str, path: list, body) -> typing.Tuple[int, dict]:
+        config_map = self.config_maps.get(cluster)
+        if method == 'POST':
+            if config_map is not None:
+                return 409, _status(409, 'AlreadyExists')
+            config_map = self.config_maps[cluster] = {
+                'apiVersion': 'v1',
+                'kind': 'ConfigMap',
+                'metadata': {'name': 'aws-auth', 'namespace': 'kube-system', 'resourceVersion': '1'},
+                'data': body.get('data') or {},
+            }
+            return 201, config_map
+        if config_map is None:
+            return 404, _status(404, 'NotFound')
+        if method == 'GET':
+            return 200, config_map
+
+        version = body.get('metadata', {}).get('resourceVersion')
+        if version is not None and version != config_map['metadata']['resourceVersion']:
+            return 409, _status(409, 'Conflict')
+        config_map['data'].update(body.get('data') or {})
+        config_map['metadata']['resourceVersion'] = str(int(config_map['metadata']['resourceVersion']) + 1)
+        return 200, config_map
+
+def _status(code: int, reason: str) -> dict:
+    return {
+        'apiVersion': 'v1',
+        'kind': 'Status',
+        'status': 'Failure',
+        'reason': reason,
+        'code': code,
+    }
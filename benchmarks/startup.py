@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Importing update-aws-auth.py must stay cheap and must not pull in the heavy
+# packages, which are only needed once AWS or a cluster is actually contacted.
+_max_import_seconds = 0.3
+_lazy_modules = ('boto3', 'botocore', 'kubernetes')
+
+_probe = '''
+import importlib.util, json, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('update_aws_auth', 'update-aws-auth.py')
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'loaded': sorted(m for m in %r if m in sys.modules),
+}))
+''' % (_lazy_modules,)
+
+def measure_import(runs: int) -> dict:
+    samples = []
+    loaded = set()
+    for _ in range(runs):
+        out = subprocess.run(
+            (sys.executable, '-c', _probe),
+            cwd=_root,
+            capture_output=True,
+            check=True,
+        )
+        result = json.loads(out.stdout)
+        samples.append(result['seconds'])
+        loaded.update(result['loaded'])
+    return {
+        'median_seconds': statistics.median(samples),
+        'loaded': sorted(loaded),
+    }
+
+def main() -> None:
+    aparser = argparse.ArgumentParser(
+        description='Check the import time of update-aws-auth.py',
+    )
+    aparser.add_argument(
+        '--runs',
+        dest='runs',
+        type=int,
+        default=5,
+        help='Number of fresh interpreters to measure',
+    )
+    args = aparser.parse_args()
+
+    result = measure_import(args.runs)
+    print('startup-import', result)
+
+    failures = []
+    if result['median_seconds'] > _max_import_seconds:
+        failures.append('import took %.3fs, limit %.3fs' % (result['median_seconds'], _max_import_seconds))
+    if result['loaded']:
+        failures.append('eagerly imported: %s' % ', '.join(result['loaded']))
+    for failure in failures:
+        print('REGRESSION', failure)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synth_baseline.json')
+
+# (worker pools, availability zones, users)
+_scenarios = [(1, 1, 10), (1, 3, 10), (10, 3, 100), (25, 3, 250), (50, 3, 500)]
+# A single EKS stack cannot hold this many pools, so these scenarios only
+# track how synthesis scales. They are still compared to the baseline, but
+# exceeding a CloudFormation quota does not fail the run.
+_informational_scenarios = {(25, 3, 250), (50, 3, 500)}
+_quick_limit = 10
+_wall_time_slack = 0.5
+
+# CloudFormation quotas. Templates larger than 51200 bytes are uploaded to S3
+# by the CDK, so the S3 limit is the one that applies.
+_resource_limit = 500
+_parameter_limit = 200
+_template_bytes_limit = 1024 * 1024
+_limit_warning_ratio = 0.8
+
+_account = '123456789012'
+_region = 'eu-central-1'
+_zones = ['eu-central-1a', 'eu-central-1b', 'eu-central-1c']
+
+def synth_variant(pools: int, azs: int, users: int) -> dict:
+    # Runs in a fresh interpreter per variant, see measure_variant.
+    sys.path[:0] = [_root, os.path.join(_root, 'infra')]
+    # Pre-seeded AZ lookup, so that no AWS access is needed. The CDK only
+    # accepts list values in context through the environment, and reads it
+    # when the App is created.
+    os.environ['CDK_CONTEXT_JSON'] = json.dumps({
+        'availability-zones:account=%s:region=%s' % (_account, _region): _zones,
+    })
+    from aws_cdk import core, aws_iam
+
+    import eks_user
+    import eks_worker
+    import infra.network
+    import infra.cluster_users
+    import infra.eks
+
+    env = core.Environment(account=_account, region=_region)
+    app = core.App(outdir=tempfile.mkdtemp())
+
+    construct_seconds = {}
+    start = time.perf_counter()
+    network_stack = infra.network.EksNetworkStack(
+        scope=app,
+        id='bench-network',
+        cidr_id=100,
+        cluster_name='bench',
+        max_azs=azs,
+        env=env,
+    )
+    construct_seconds['network'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cluster_stack = infra.eks.EksStack(
+        scope=app,
+        id='bench-eks',
+        cluster_name='bench',
+        cluster_version='1.14',
+        vpc=network_stack.vpc,
+        node_pools=[
+            eks_worker.NodePool(
+                name='bench-%d' % index,
+                taints=['dedicated=bench-%d:NoSchedule' % index] if index else None,
+                ingress=index == 0,
+            )
+            for index in range(pools)
+        ],
+        env=env,
+    )
+    construct_seconds['eks'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    users_stack = infra.cluster_users.EksClusterUsersStack(
+        scope=app,
+        id='bench-users',
+        clusters=[cluster_stack.cluster],
+        env=env,
+    )
+    for index in range(len(users_stack.cluster_users), users):
+        eks_user.eks_user(
+            scope=users_stack,
+            id='bench-user-%d' % index,
+            role_name='bench-user-%d' % index,
+            k8s_username='bench-user-%d' % index,
+            k8s_groups=['bench'],
+            clusters=[cluster_stack.cluster],
+            principal=aws_iam.AccountRootPrincipal(),
+        )
+    construct_seconds['users'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assembly = app.synth()
+    synth_seconds = time.perf_counter() - start
+
+    stacks = {}
+    for key, stack in (('network', network_stack), ('eks', cluster_stack), ('users', users_stack)):
+        artifact = assembly.get_stack(stack.stack_name)
+        template = artifact.template
+        stacks[key] = {
+            'construct_seconds': round(construct_seconds[key], 4),
+            'template_bytes': os.path.getsize(os.path.join(assembly.directory, artifact.template_file)),
+            'resources': len(template.get('Resources', {})),
+            'parameters': len(template.get('Parameters', {})),
+        }
+    return {
+        'synth_seconds': round(synth_seconds, 4),
+        'stacks': stacks,
+    }
+
+def measure_variant(pools: int, azs: int, users: int) -> dict:
+    # Most of the memory is used by the jsii node process, which tracemalloc
+    # cannot see. Each variant runs in its own interpreter instead, and the
+    # peak RSS of that process tree is read from wait4.
+    proc = subprocess.Popen(
+        (sys.executable, os.path.abspath(__file__), '--variant', '%d,%d,%d' % (pools, azs, users)),
+        cwd=_root,
+        stdout=subprocess.PIPE,
+    )
+    stdout = proc.stdout.read()
+    proc.stdout.close()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = status
+    if status != 0:
+        raise RuntimeError('Synthesizing variant %d,%d,%d failed' % (pools, azs, users))
+
+    result = json.loads(stdout)
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss_bytes'] = rusage.ru_maxrss * 1024
+    return result
+
+def scenario_name(pools: int, azs: int, users: int) -> str:
+    return 'synth-%dpools-%dazs-%dusers' % (pools, azs, users)
+
+def run_benchmarks(quick: bool) -> dict:
+    results = {}
+    for pools, azs, users in _scenarios:
+        if quick and pools > _quick_limit:
+            continue
+        name = scenario_name(pools, azs, users)
+        results[name] = measure_variant(pools, azs, users)
+        print(name, results[name])
+    return results
+
+def find_limit_violations(results: dict) -> typing.List[str]:
+    violations = []
+    for name, result in sorted(results.items()):
+        for stack, stats in sorted(result['stacks'].items()):
+            for metric, limit in (
+                ('resources', _resource_limit),
+                ('parameters', _parameter_limit),
+                ('template_bytes', _template_bytes_limit),
+            ):
+                if stats[metric] > limit * _limit_warning_ratio:
+                    violations.append('%s/%s: %d %s, CloudFormation limit %d' % (
+                        name, stack, stats[metric], metric, limit,
+                    ))
+    return violations
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> typing.List[str]:
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        wall = result['synth_seconds'] + sum(s['construct_seconds'] for s in result['stacks'].values())
+        expected_wall = expected['synth_seconds'] + sum(s['construct_seconds'] for s in expected['stacks'].values())
+        if wall > expected_wall * tolerance + _wall_time_slack:
+            regressions.append('%s: %.3fs construct and synth time, baseline %.3fs' % (name, wall, expected_wall))
+        if result['peak_rss_bytes'] > expected['peak_rss_bytes'] * tolerance:
+            regressions.append('%s: %d bytes peak RSS, baseline %d' % (
+                name, result['peak_rss_bytes'], expected['peak_rss_bytes'],
+            ))
+        for stack, stats in sorted(result['stacks'].items()):
+            expected_stats = expected['stacks'].get(stack)
+            if expected_stats is None:
+                continue
+            if stats['resources'] > expected_stats['resources']:
+                regressions.append('%s/%s: %d resources, baseline %d' % (
+                    name, stack, stats['resources'], expected_stats['resources'],
+                ))
+            if stats['template_bytes'] > expected_stats['template_bytes'] * tolerance:
+                regressions.append('%s/%s: %d template bytes, baseline %d' % (
+                    name, stack, stats['template_bytes'], expected_stats['template_bytes'],
+                ))
+    return regressions
+
+def main() -> None:
+    aparser = argparse.ArgumentParser(
+        description='Benchmark synthesis of the CDK stacks without AWS access',
+    )
+    aparser.add_argument(
+        '--quick',
+        dest='quick',
+        action='store_true',
+        help='Skip the largest scenarios',
+    )
+    aparser.add_argument(
+        '--baseline',
+        dest='baseline',
+        default=_default_baseline,
+        help='Baseline file to compare against',
+    )
+    aparser.add_argument(
+        '--tolerance',
+        dest='tolerance',
+        type=float,
+        default=1.5,
+        help='Allowed slowdown/growth factor relative to the baseline',
+    )
+    aparser.add_argument(
+        '--write-baseline',
+        dest='write_baseline',
+        action='store_true',
+        help='Store the results as the new baseline',
+    )
+    aparser.add_argument(
+        '--variant',
+        dest='variant',
+        help=argparse.SUPPRESS,
+    )
+    args = aparser.parse_args()
+
+    if args.variant:
+        pools, azs, users = (int(v) for v in args.variant.split(','))
+        json.dump(synth_variant(pools, azs, users), sys.stdout)
+        return
+
+    results = run_benchmarks(args.quick)
+    if args.write_baseline:
+        with open(args.baseline, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+        return
+
+    informational = {scenario_name(*scenario) for scenario in _informational_scenarios}
+    failures = []
+    for name, result in sorted(results.items()):
+        for violation in find_limit_violations({name: result}):
+            if name in informational:
+                print('LIMIT (informational) ' + violation)
+            else:
+                failures.append('LIMIT ' + violation)
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        failures.extend('REGRESSION ' + r for r in find_regressions(results, baseline, args.tolerance))
+    else:
+        print('No baseline at %s, only checking CloudFormation limits' % args.baseline)
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
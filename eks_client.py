@@ -1,33 +1,564 @@
+#!/usr/bin/env python3
+
+import argparse
+import atexit
+import atomic_file
 import base64
-import boto3
-import kubernetes
-import tempfile
-import subprocess
+import collections
+import datetime
+import hashlib
 import json
+import os
+import sys
+import metrics
+import rate_limit
+import stat
+import tempfile
+import threading
+import time
+import typing
+
+# boto3 and kubernetes are imported where they are first needed, since
+# importing them dominates the start-up time of short-lived commands.
+
+# EKS accepts a token for 15 minutes after it was signed. Cached tokens are
+# refreshed a minute early to leave room for clock skew and slow requests.
+_token_prefix = 'k8s-aws-v1.'
+_token_lifetime = 15 * 60
+_token_refresh_margin = 60
+
+_cluster_info_ttl = 60 * 60
+_connection_pool_maxsize = 4
+
+ClusterInfo = collections.namedtuple('ClusterInfo', ['endpoint', 'ca_data', 'fetched_at'])
+
+# Assumed role sessions are replaced this long before their credentials expire.
+_session_refresh_margin = 5 * 60
+
+_sessions = {}
+_clients = {}
+_client_lock = threading.Lock()
+_tokens = {}
+_tokens_lock = threading.Lock()
+_cache_dir = None
+_cluster_infos = {}
+_cluster_infos_lock = threading.Lock()
+_cache_stats = collections.Counter()
+_api_clients = {}
+_api_clients_lock = threading.Lock()
+_token_cache_path = None
+
+def configure_cache(
+    cache_dir: typing.Optional[str]=None,
+    ttl: typing.Optional[int]=None,
+) -> None:
+    global _cache_dir, _cluster_info_ttl
+    _cache_dir = cache_dir
+    if ttl is not None:
+        _cluster_info_ttl = ttl
+
+def configure_token_cache(path: typing.Optional[str]) -> None:
+    # Tokens are also kept in a file shared by all processes, which is what
+    # makes the kubectl credential plugin cheap after the first call.
+    global _token_cache_path
+    _token_cache_path = path
+
+def configure_clients(connection_pool_maxsize: int) -> None:
+    global _connection_pool_maxsize
+    _connection_pool_maxsize = connection_pool_maxsize
+
+def cache_stats() -> dict:
+    with _cluster_infos_lock:
+        return dict(_cache_stats)
+
+def for_cluster(
+    cluster: str,
+    role_arn: typing.Optional[str]=None,
+    region: typing.Optional[str]=None,
+) -> 'kubernetes.client.ApiClient':
+    # One client is kept per cluster so its connection pool stays warm between
+    # calls. The token is swapped in place whenever the cached one is renewed.
+    # A cluster recreated under the same name comes back with a new endpoint
+    # and CA, which the client is then rebuilt for.
+    key = (cluster, role_arn, region)
+    info = get_cluster_info(cluster, role_arn, region)
+    with _api_clients_lock:
+        cached = _api_clients.get(key)
+
+    if cached is None or cached[0] != (info.endpoint, info.ca_data):
+        client = _new_api_client(info, cluster, role_arn, region)
+        with _api_clients_lock:
+            existing = _api_clients.get(key)
+            if existing is cached or existing is None:
+                _api_clients[key] = ((info.endpoint, info.ca_data), client)
+        if existing is None or existing is cached:
+            if cached is not None:
+                _close_api_client(cached[1])
+        else:
+            # Another thread built a client first.
+            _close_api_client(client)
+            client = existing[1]
+    else:
+        client = cached[1]
+
+    _refresh_api_key(client.configuration, cluster, role_arn, region)
+    return client
+
+def close() -> None:
+    with _api_clients_lock:
+        clients = [client for _, client in _api_clients.values()]
+        _api_clients.clear()
+    for client in clients:
+        _close_api_client(client)
+
+def _new_api_client(
+    info: ClusterInfo,
+    cluster: str,
+    role_arn: typing.Optional[str],
+    region: typing.Optional[str],
+) -> 'kubernetes.client.ApiClient':
+    import kubernetes
 
-def for_cluster(cluster: str) -> kubernetes.client.ApiClient:
-    eks_client = boto3.client('eks')
-    eks_details = eks_client.describe_cluster(name=cluster)['cluster']
-    endpoint = eks_details['endpoint']
-    ca_data = eks_details['certificateAuthority']['data']
-    
     conf = kubernetes.client.Configuration()
-    conf.host = endpoint
-    conf.api_key['authorization'] = _get_token(cluster)
-    conf.api_key_prefix['authorization'] = 'Bearer'
-    conf.ssl_ca_cert = _save_eks_ca_cert(ca_data)
-    
+    conf.host = info.endpoint
+    # Older Kubernetes clients copy every Configuration from a shared default,
+    # dicts included, so each one needs dicts of its own.
+    conf.api_key = {'authorization': get_token(cluster, role_arn, region)}
+    conf.api_key_prefix = {'authorization': 'Bearer'}
+    conf.ssl_ca_cert = _save_eks_ca_cert(info.ca_data)
+    conf.connection_pool_maxsize = _connection_pool_maxsize
+    # Newer Kubernetes clients call this hook before each request.
+    conf.refresh_api_key_hook = lambda c: _refresh_api_key(c, cluster, role_arn, region)
+
     return kubernetes.client.ApiClient(conf)
 
-def _get_token(cluster: str) -> str:
-    args = ('aws', 'eks', 'get-token', '--cluster-name', cluster)
-    out = subprocess.run(args, capture_output=True, check=True)
-    out_json = json.loads(out.stdout)
-    return out_json['status']['token']
+def _refresh_api_key(
+    conf: 'kubernetes.client.Configuration',
+    cluster: str,
+    role_arn: typing.Optional[str],
+    region: typing.Optional[str],
+) -> None:
+    conf.api_key['authorization'] = get_token(cluster, role_arn, region)
+
+def _close_api_client(client: 'kubernetes.client.ApiClient') -> None:
+    if hasattr(client, 'close'):
+        client.close()
+    else:
+        client.rest_client.pool_manager.clear()
+
+atexit.register(close)
+
+def get_cluster_info(
+    cluster: str,
+    role_arn: typing.Optional[str]=None,
+    region: typing.Optional[str]=None,
+) -> ClusterInfo:
+    key = (cluster, role_arn, region)
+    now = time.time()
+    with _cluster_infos_lock:
+        info = _cluster_infos.get(key)
+        if info and info.fetched_at + _cluster_info_ttl > now:
+            _cache_stats['hits'] += 1
+            return info
+
+    info = _load_cluster_info(key)
+    if info and info.fetched_at + _cluster_info_ttl > now:
+        stat = 'disk_hits'
+    else:
+        stat = 'misses'
+        eks_client = client_for('eks', role_arn, region)
+        eks_details = eks_client.describe_cluster(name=cluster)['cluster']
+        info = ClusterInfo(
+            endpoint=eks_details['endpoint'],
+            ca_data=eks_details['certificateAuthority']['data'],
+            fetched_at=now,
+        )
+        _store_cluster_info(key, info)
+
+    with _cluster_infos_lock:
+        _cache_stats[stat] += 1
+        _cluster_infos[key] = info
+    return info
+
+def _cluster_info_path(key: tuple) -> str:
+    cluster, role_arn, region = key
+    name = cluster
+    if role_arn or region:
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        name = '%s-%s' % (cluster, digest[:16])
+    return os.path.join(_cache_dir, 'clusters', name + '.json')
+
+def _load_cluster_info(key: tuple) -> typing.Optional[ClusterInfo]:
+    if not _cache_dir:
+        return None
+    try:
+        with open(_cluster_info_path(key)) as fp:
+            return ClusterInfo(**json.load(fp))
+    except (OSError, ValueError, TypeError):
+        return None
+
+def _store_cluster_info(key: tuple, info: ClusterInfo) -> None:
+    if not _cache_dir:
+        return
+    atomic_file.write(
+        _cluster_info_path(key),
+        json.dumps(info._asdict()).encode('utf-8'),
+    )
+
+def get_token(
+    cluster: str,
+    role_arn: typing.Optional[str]=None,
+    region: typing.Optional[str]=None,
+) -> str:
+    return _get_cached_token(cluster, role_arn, region)[0]
+
+def _get_cached_token(
+    cluster: str,
+    role_arn: typing.Optional[str],
+    region: typing.Optional[str],
+) -> tuple:
+    key = (cluster, role_arn, region)
+    now = time.time()
+    with _tokens_lock:
+        cached = _tokens.get(key)
+    if cached and cached[1] - _token_refresh_margin > now:
+        return cached
+
+    if _token_cache_path:
+        cached = _get_file_cached_token(cluster, role_arn, region, now)
+    else:
+        cached = (_generate_token(cluster, role_arn, region), now + _token_lifetime)
+    with _tokens_lock:
+        _tokens[key] = cached
+    return cached
+
+# Settings that select which AWS identity signs the token.
+_credential_env_vars = (
+    'AWS_PROFILE',
+    'AWS_DEFAULT_PROFILE',
+    'AWS_ACCESS_KEY_ID',
+    'AWS_SECRET_ACCESS_KEY',
+    'AWS_SESSION_TOKEN',
+    'AWS_ROLE_ARN',
+    'AWS_WEB_IDENTITY_TOKEN_FILE',
+    'AWS_CONFIG_FILE',
+    'AWS_SHARED_CREDENTIALS_FILE',
+)
+
+def _credentials_fingerprint() -> str:
+    # Tokens are only shared between processes that use the same identity.
+    # Resolving the identity would need boto3 or even an STS call, so
+    # everything that selects it is hashed instead: the credential env vars
+    # and the modification times of the shared config files.
+    digest = hashlib.sha256()
+    for name in _credential_env_vars:
+        digest.update(('%s=%s\0' % (name, os.environ.get(name, ''))).encode('utf-8'))
+    for path in (
+        os.environ.get('AWS_CONFIG_FILE', '~/.aws/config'),
+        os.environ.get('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials'),
+    ):
+        try:
+            mtime = os.stat(os.path.expanduser(path)).st_mtime_ns
+        except OSError:
+            mtime = 0
+        digest.update(('%s=%d\0' % (path, mtime)).encode('utf-8'))
+    return digest.hexdigest()
+
+def _get_file_cached_token(
+    cluster: str,
+    role_arn: typing.Optional[str],
+    region: typing.Optional[str],
+    now: float,
+) -> tuple:
+    import fcntl
+
+    key = '|'.join((cluster, role_arn or '', region or '', _credentials_fingerprint()))
+    directory = os.path.dirname(os.path.abspath(_token_cache_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    # The lock is held while a missing token is generated, so concurrent
+    # processes wait for the first one instead of all signing their own.
+    with open(_token_cache_path + '.lock', 'a') as lock_fp:
+        fcntl.flock(lock_fp, fcntl.LOCK_EX)
+        try:
+            with open(_token_cache_path) as fp:
+                tokens = json.load(fp)
+        except (OSError, ValueError):
+            tokens = {}
+
+        cached = tokens.get(key)
+        if cached and cached[1] - _token_refresh_margin > now:
+            return tuple(cached)
+
+        cached = (_generate_token(cluster, role_arn, region), now + _token_lifetime)
+        tokens = {k: v for k, v in tokens.items() if v[1] > now}
+        tokens[key] = cached
+        atomic_file.write(_token_cache_path, json.dumps(tokens).encode('utf-8'))
+        return cached
+
+def session_for(
+    role_arn: typing.Optional[str]=None,
+    region: typing.Optional[str]=None,
+) -> 'boto3.session.Session':
+    import boto3
+
+    # boto3 sessions are not thread-safe, so sessions and clients are created
+    # under a lock and shared. Clients can be used from multiple threads.
+    key = (role_arn, region)
+    with _client_lock:
+        cached = _sessions.get(key)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+    if not role_arn:
+        with _client_lock:
+            session = boto3.session.Session(region_name=region)
+        expires_at = float('inf')
+    else:
+        sts_client = client_for('sts', region=region)
+        assumed = sts_client.assume_role(
+            RoleArn=role_arn,
+            RoleSessionName='eks-client',
+        )['Credentials']
+        region_name = region or session_for().region_name
+        with _client_lock:
+            session = boto3.session.Session(
+                aws_access_key_id=assumed['AccessKeyId'],
+                aws_secret_access_key=assumed['SecretAccessKey'],
+                aws_session_token=assumed['SessionToken'],
+                region_name=region_name,
+            )
+        expires_at = assumed['Expiration'].timestamp() - _session_refresh_margin
+
+    with _client_lock:
+        _sessions[key] = (session, expires_at)
+    return session
+
+def client_for(
+    service: str,
+    role_arn: typing.Optional[str]=None,
+    region: typing.Optional[str]=None,
+):
+    session = session_for(role_arn, region)
+    key = (service, role_arn, region)
+    with _client_lock:
+        cached = _clients.get(key)
+        if cached is None or cached[0] is not session:
+            client = session.client(service)
+            # Throttling in one account or region does not slow down the others.
+            rate_limit.default_limiter.instrument(client, ' '.join(filter(None, (role_arn, region))))
+            metrics.default_registry.instrument(client)
+            cached = (session, client)
+            _clients[key] = cached
+        return cached[1]
+
+def _generate_token(
+    cluster: str,
+    role_arn: typing.Optional[str],
+    region: typing.Optional[str],
+) -> str:
+    session = session_for(role_arn, region)
+    region = session.region_name or 'us-east-1'
+    credentials = session.get_credentials()
+
+    # The token is a presigned STS GetCallerIdentity URL, with the cluster name
+    # included as a signed header. This is what `aws eks get-token` produces.
+    import botocore.model
+    import botocore.signers
+
+    signer = botocore.signers.RequestSigner(
+        botocore.model.ServiceId('sts'),
+        region,
+        'sts',
+        'v4',
+        credentials,
+        session._session.get_component('event_emitter'),
+    )
+    url = signer.generate_presigned_url(
+        {
+            'method': 'GET',
+            'url': 'https://sts.%s.amazonaws.com/?Action=GetCallerIdentity&Version=2011-06-15' % region,
+            'body': {},
+            'headers': {'x-k8s-aws-id': cluster},
+            'context': {},
+        },
+        region_name=region,
+        expires_in=60,
+        operation_name='',
+    )
+    encoded = base64.urlsafe_b64encode(url.encode('utf-8')).decode('utf-8')
+    return _token_prefix + encoded.rstrip('=')
 
 def _save_eks_ca_cert(ca_cert_b64: str) -> str:
-    fp = tempfile.NamedTemporaryFile(delete=False)
+    # CA files are named after their content, so each certificate is written
+    # only once no matter how many times a cluster is connected to.
     cert_bs = base64.urlsafe_b64decode(ca_cert_b64.encode('utf-8'))
-    fp.write(cert_bs)
-    fp.close()
-    return fp.name
+    if _cache_dir:
+        ca_dir = os.path.join(_cache_dir, 'eks-client-ca')
+    else:
+        ca_dir = os.path.join(tempfile.gettempdir(), 'eks-client-ca-%d' % os.getuid())
+    _ensure_private_dir(ca_dir)
+    path = os.path.join(ca_dir, hashlib.sha256(cert_bs).hexdigest() + '.crt')
+    try:
+        with open(path, 'rb') as fp:
+            existing = fp.read()
+    except FileNotFoundError:
+        existing = None
+    if existing != cert_bs:
+        atomic_file.write(path, cert_bs)
+    return path
+
+def _ensure_private_dir(path: str) -> None:
+    # Trusted CA files must not be replaceable by other local users, so the
+    # directory has to belong to us and be closed to everyone else.
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError('%s must be a directory owned by the current user with mode 0700' % path)
+
+def exec_credential(
+    cluster: str,
+    role_arn: typing.Optional[str]=None,
+    region: typing.Optional[str]=None,
+    api_version: str='client.authentication.k8s.io/v1beta1',
+) -> dict:
+    token, expires_at = _get_cached_token(cluster, role_arn, region)
+    # kubectl calls the plugin again once the reported expiration passes, which
+    # is set to when the cache would renew the token anyway.
+    expiration = datetime.datetime.fromtimestamp(expires_at - _token_refresh_margin, datetime.timezone.utc)
+    return {
+        'kind': 'ExecCredential',
+        'apiVersion': api_version,
+        'spec': {},
+        'status': {
+            'expirationTimestamp': expiration.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'token': token,
+        },
+    }
+
+def list_clusters(
+    role_arn: typing.Optional[str]=None,
+    region: typing.Optional[str]=None,
+) -> typing.List[str]:
+    paginator = client_for('eks', role_arn, region).get_paginator('list_clusters')
+    return [
+        cluster
+        for page in paginator.paginate()
+        for cluster in page.get('clusters', [])
+    ]
+
+def write_kubeconfig(
+    path: str,
+    role_arn: typing.Optional[str]=None,
+    regions: typing.Optional[typing.List[str]]=None,
+) -> typing.List[str]:
+    import yaml
+
+    try:
+        with open(path) as fp:
+            config = yaml.safe_load(fp) or {}
+    except FileNotFoundError:
+        config = {}
+    config.setdefault('apiVersion', 'v1')
+    config.setdefault('kind', 'Config')
+
+    names = []
+    for region in regions or [None]:
+        for cluster in list_clusters(role_arn, region):
+            info = get_cluster_info(cluster, role_arn, region)
+            name = cluster if region is None else '%s.%s' % (cluster, region)
+            args = [os.path.abspath(__file__), 'token', '--cluster-name', cluster]
+            if role_arn:
+                args.extend(['--role-arn', role_arn])
+            if region:
+                args.extend(['--region', region])
+            _merge_named(config, 'clusters', name, {
+                'cluster': {
+                    'server': info.endpoint,
+                    'certificate-authority-data': info.ca_data,
+                },
+            })
+            _merge_named(config, 'users', name, {
+                'user': {
+                    'exec': {
+                        'apiVersion': 'client.authentication.k8s.io/v1beta1',
+                        'command': sys.executable,
+                        'args': args,
+                    },
+                },
+            })
+            _merge_named(config, 'contexts', name, {
+                'context': {
+                    'cluster': name,
+                    'user': name,
+                },
+            })
+            names.append(name)
+
+    atomic_file.write(path, yaml.safe_dump(config, default_flow_style=False).encode('utf-8'))
+    return names
+
+def _merge_named(config: dict, section: str, name: str, entry: dict) -> None:
+    entries = [e for e in config.get(section) or [] if e.get('name') != name]
+    entries.append(dict(entry, name=name))
+    config[section] = sorted(entries, key=lambda e: e['name'])
+
+def main() -> None:
+    aparser = argparse.ArgumentParser(
+        description='EKS authentication helpers',
+    )
+    aparser.add_argument(
+        '--token-cache',
+        dest='token_cache',
+        default=os.path.expanduser('~/.kube/cache/eks-client/tokens.json'),
+        help='File for caching tokens between processes',
+    )
+    subparsers = aparser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    token_parser = subparsers.add_parser(
+        'token',
+        help='Print an ExecCredential for kubectl',
+    )
+    token_parser.add_argument('--cluster-name', dest='cluster', required=True)
+    token_parser.add_argument('--role-arn', dest='role_arn')
+    token_parser.add_argument('--region', dest='region')
+
+    kubeconfig_parser = subparsers.add_parser(
+        'kubeconfig',
+        help='Write kubeconfig entries for every discovered cluster',
+    )
+    kubeconfig_parser.add_argument('--role-arn', dest='role_arn')
+    kubeconfig_parser.add_argument(
+        '--region',
+        dest='regions',
+        action='append',
+        help='Region to discover clusters in (repeatable)',
+    )
+    kubeconfig_parser.add_argument(
+        '--kubeconfig',
+        dest='kubeconfig',
+        default=os.environ.get('KUBECONFIG', '~/.kube/config').split(os.pathsep)[0],
+        help='Kubeconfig file to update',
+    )
+    args = aparser.parse_args()
+
+    configure_token_cache(args.token_cache)
+    if args.command == 'token':
+        # kubectl passes the ExecCredential version it expects in this variable.
+        exec_info = json.loads(os.environ.get('KUBERNETES_EXEC_INFO') or '{}')
+        credential = exec_credential(
+            args.cluster,
+            args.role_arn,
+            args.region,
+            exec_info.get('apiVersion', 'client.authentication.k8s.io/v1beta1'),
+        )
+        json.dump(credential, sys.stdout)
+        sys.stdout.write('\n')
+    else:
+        path = os.path.expanduser(args.kubeconfig)
+        for name in write_kubeconfig(path, args.role_arn, args.regions):
+            print('Added context:', name)
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,19 @@ from aws_cdk import (
     aws_eks,
 )
 
+_default_node_pools = (
+    eks_worker.NodePool(
+        name='default',
+        instance_type='t3.large',
+        min_capacity=1,
+        max_capacity=5,
+        kubelet_extra_args={
+            'eviction-hard': 'memory.available<0.5Gi,nodefs.available<5%',
+        },
+        ingress=True,
+    ),
+)
+
 class EksStack(core.Stack):
     def __init__(
         self,
@@ -16,6 +29,7 @@ class EksStack(core.Stack):
         cluster_version: str,
         cluster_name: str,
         vpc: aws_ec2.IVpc,
+        node_pools: typing.Optional[typing.List[eks_worker.NodePool]]=None,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
@@ -40,26 +54,45 @@ class EksStack(core.Stack):
         )
 
         # Nodes
-        self.default_worker = eks_worker.EksWorker(
-            scope=self,
-            id='default-nodes',
-            name='default',
-            stack_name=self.stack_name,
-            region=self.region,
-            cluster_version=cluster_version,
-            cluster=self.cluster,
-            control_plane_sg=self.control_plane_sg,
-            instance_type=aws_ec2.InstanceType.of(
-                instance_class=aws_ec2.InstanceClass.BURSTABLE3,
-                instance_size=aws_ec2.InstanceSize.LARGE,
-            ),
-            min_capacity=1,
-            max_capacity=5,
-            rolling_update_pause_time=core.Duration.minutes(amount=1),
-            kubelet_extra_args={
-                'eviction-hard': 'memory.available<0.5Gi,nodefs.available<5%',
-            }
-        )
+        node_pools = node_pools or _default_node_pools
+        names = [pool.name for pool in node_pools]
+        if len(set(names)) != len(names):
+            raise ValueError('Node pool names must be unique: %s' % ', '.join(names))
+        # The load balancers need at least one target group.
+        if not any(pool.ingress for pool in node_pools):
+            raise ValueError('At least one node pool needs ingress: true, pools: %s' % ', '.join(names))
+
+        self.workers = {}
+        for pool in node_pools:
+            self.workers[pool.name] = eks_worker.EksWorker(
+                scope=self,
+                id=pool.name + '-nodes',
+                name=pool.name,
+                stack_name=self.stack_name,
+                region=self.region,
+                cluster_version=cluster_version,
+                cluster=self.cluster,
+                control_plane_sg=self.control_plane_sg,
+                instance_type=aws_ec2.InstanceType(pool.instance_type),
+                min_capacity=pool.min_capacity,
+                max_capacity=pool.max_capacity,
+                root_volume_size=pool.root_volume_size,
+                rolling_update_pause_time=core.Duration.minutes(amount=1),
+                kubelet_extra_args=pool.kubelet_extra_args,
+                labels=pool.labels,
+                taints=pool.taints,
+                extra_instance_types=pool.extra_instance_types,
+                on_demand_base_capacity=pool.on_demand_base_capacity,
+                spot_percentage=pool.spot_percentage,
+                kubelet_profile=pool.kubelet_profile,
+                rolling_update=pool.rolling_update,
+            )
+        ingress_asgs = [
+            asg
+            for pool in node_pools
+            if pool.ingress
+            for asg in self.workers[pool.name].asgs
+        ]
 
         # Ingress
         self.public_ingress = ingress.IngressConstruct(
@@ -69,7 +102,7 @@ class EksStack(core.Stack):
             instance_port=32080,
             internet_facing=True,
             subnets=vpc.public_subnets,
-            targets=self.default_worker.asgs,
+            targets=ingress_asgs,
             ssl_certificate_id=None,
         )
         self.private_ingress = ingress.IngressConstruct(
@@ -79,7 +112,7 @@ class EksStack(core.Stack):
             instance_port=31080,
             internet_facing=False,
             subnets=vpc.private_subnets,
-            targets=self.default_worker.asgs,
+            targets=ingress_asgs,
             allow_connections_from=[
                 aws_ec2.Peer.ipv4('10.0.0.0/8'),
             ],
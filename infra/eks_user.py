@@ -6,6 +6,11 @@ from aws_cdk import (
     aws_iam,
 )
 
+# IAM tag values are limited to 256 characters. Cluster names are usually
+# tokens at synth time, so their length is assumed to be the EKS maximum.
+_tag_value_max_length = 256
+_cluster_name_max_length = 100
+
 _eks_node_role_base_policies = (
     aws_iam.ManagedPolicy.from_aws_managed_policy_name('AmazonEKSWorkerNodePolicy'),
     aws_iam.ManagedPolicy.from_aws_managed_policy_name('AmazonEKS_CNI_Policy'),
@@ -41,22 +46,17 @@ def eks_user(
         }
     )
 
-    for cluster in clusters:
-        core.Tag.add(
-            scope=role,
-            key='eks/%s/type' % cluster.cluster_name,
-            value='user'
-        )
-        core.Tag.add(
-            scope=role,
-            key='eks/%s/username' % cluster.cluster_name,
-            value=k8s_username,
-        )
-        core.Tag.add(
-            scope=role,
-            key='eks/%s/groups' % cluster.cluster_name,
-            value=','.join(k8s_groups),
-        )
+    core.Tag.add(
+        scope=role,
+        key='eks-user/username',
+        value=k8s_username,
+    )
+    core.Tag.add(
+        scope=role,
+        key='eks-user/groups',
+        value=','.join(k8s_groups),
+    )
+    _add_cluster_tags(role, 'eks-user/clusters', clusters)
 
     return role
 
@@ -75,10 +75,33 @@ def eks_node_role(
         managed_policies=list(_eks_node_role_base_policies),
     )
 
-    core.Tag.add(
-        scope=role,
-        key='eks/%s/type' % cluster.cluster_name,
-        value='node'
-    )
+    _add_cluster_tags(role, 'eks-node/clusters', [cluster])
 
     return role
+
+def _add_cluster_tags(
+    scope: core.Construct,
+    key: str,
+    clusters: typing.List[aws_eks.ICluster],
+) -> None:
+    # Cluster names are packed into as few tag values as possible:
+    # <key>, <key>/1, <key>/2, ...
+    chunks = []
+    length = _tag_value_max_length
+    for cluster in clusters:
+        name = cluster.cluster_name
+        name_length = len(name)
+        if core.Token.is_unresolved(name):
+            name_length = _cluster_name_max_length
+        if not chunks or length + 1 + name_length > _tag_value_max_length:
+            chunks.append([])
+            length = -1
+        chunks[-1].append(name)
+        length += 1 + name_length
+
+    for index, chunk in enumerate(chunks):
+        core.Tag.add(
+            scope=scope,
+            key=key if index == 0 else '%s/%d' % (key, index),
+            value=' '.join(chunk),
+        )
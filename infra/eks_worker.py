@@ -1,3 +1,5 @@
+import math
+import re
 import typing
 import eks_user
 
@@ -8,6 +10,111 @@ from aws_cdk import (
     aws_eks,
 )
 
+_taint_effects = ('NoSchedule', 'PreferNoSchedule', 'NoExecute')
+
+_reserved_resources = ('cpu', 'memory', 'ephemeral-storage', 'pid')
+_eviction_signals = (
+    'memory.available',
+    'nodefs.available',
+    'nodefs.inodesFree',
+    'imagefs.available',
+    'imagefs.inodesFree',
+    'pid.available',
+)
+_cpu_manager_policies = ('none', 'static')
+_topology_manager_policies = ('none', 'best-effort', 'restricted', 'single-numa-node')
+_quantity_pattern = re.compile(r'^[0-9]+(\.[0-9]+)?(m|k|M|G|T|Ki|Mi|Gi|Ti)?$')
+_percentage_pattern = re.compile(r'^[0-9]+(\.[0-9]+)?%$')
+_duration_pattern = re.compile(r'^([0-9]+(\.[0-9]+)?(ns|us|ms|s|m|h))+$')
+
+# (ENIs, IPv4 addresses per ENI, vCPUs) for computing max-pods with ENI
+# prefix delegation. Other instance types need an explicit max_pods.
+_eni_limits = {
+    't3.large': (3, 12, 2),
+    't3.xlarge': (4, 15, 4),
+    't3.2xlarge': (4, 15, 8),
+    'm5.large': (3, 10, 2),
+    'm5.xlarge': (4, 15, 4),
+    'm5.2xlarge': (4, 15, 8),
+    'm5.4xlarge': (8, 30, 16),
+    'c5.large': (3, 10, 2),
+    'c5.xlarge': (4, 15, 4),
+    'c5.2xlarge': (4, 15, 8),
+    'c5.4xlarge': (8, 30, 16),
+    'r5.large': (3, 10, 2),
+    'r5.xlarge': (4, 15, 4),
+    'r5.2xlarge': (4, 15, 8),
+    'r5.4xlarge': (8, 30, 16),
+    'r5a.large': (3, 10, 2),
+    'r5a.xlarge': (4, 15, 4),
+    'r5a.2xlarge': (4, 15, 8),
+    'r5a.4xlarge': (8, 30, 16),
+    'r5d.large': (3, 10, 2),
+    'r5d.xlarge': (4, 15, 4),
+    'r5d.2xlarge': (4, 15, 8),
+    'r5d.4xlarge': (8, 30, 16),
+}
+
+# Kubelet tuning for a node pool. Reserved resources and eviction thresholds
+# are given as dicts, e.g. kube_reserved={'cpu': '250m', 'memory': '1Gi'} and
+# eviction_hard={'memory.available': '500Mi'}.
+class KubeletProfile(typing.NamedTuple):
+    kube_reserved: typing.Optional[dict]=None
+    system_reserved: typing.Optional[dict]=None
+    cpu_manager_policy: str='none'
+    topology_manager_policy: typing.Optional[str]=None
+    max_pods: typing.Optional[int]=None
+    # Size max-pods for ENI prefix delegation, which must also be enabled
+    # in the VPC CNI.
+    prefix_delegation: bool=False
+    image_gc_high_threshold_percent: typing.Optional[int]=None
+    image_gc_low_threshold_percent: typing.Optional[int]=None
+    eviction_hard: typing.Optional[dict]=None
+    eviction_soft: typing.Optional[dict]=None
+    eviction_soft_grace_period: typing.Optional[dict]=None
+
+# Rolling update settings for the per-AZ groups of a node pool, mapped onto
+# CloudFormation's AutoScalingRollingUpdate policy:
+#  - max_batch_percent of the group's max capacity (at least one instance) is
+#    replaced at a time.
+#  - min_in_service_percent of the group's min capacity stays in service.
+#    CloudFormation compares this with the current desired capacity, and only
+#    launches replacements before terminating when a batch would drop the
+#    group below it. A group scaled above its min capacity can therefore lose
+#    a whole batch at once. The value has to stay below MaxSize, so a group
+#    with a max capacity of 1 is always replaced with downtime.
+# With parallel_zones, all zones roll at the same time.
+class RollingUpdate(typing.NamedTuple):
+    max_batch_percent: int=25
+    min_in_service_percent: int=100
+    parallel_zones: bool=True
+
+# Specification of a node pool. Taints are given as 'key=value:Effect'.
+class NodePool(typing.NamedTuple):
+    name: str
+    instance_type: str='t3.large'
+    min_capacity: int=1
+    max_capacity: int=5
+    labels: typing.Optional[dict]=None
+    taints: typing.Optional[typing.List[str]]=None
+    kubelet_extra_args: typing.Optional[dict]=None
+    root_volume_size: int=20
+    ingress: bool=False
+    extra_instance_types: typing.Optional[typing.List[str]]=None
+    on_demand_base_capacity: int=0
+    spot_percentage: int=0
+    kubelet_profile: typing.Optional[KubeletProfile]=None
+    rolling_update: typing.Optional[RollingUpdate]=None
+
+def node_pool_from_config(config: dict) -> NodePool:
+    profile = config.get('kubelet_profile')
+    if isinstance(profile, dict):
+        config = dict(config, kubelet_profile=KubeletProfile(**profile))
+    rolling_update = config.get('rolling_update')
+    if isinstance(rolling_update, dict):
+        config = dict(config, rolling_update=RollingUpdate(**rolling_update))
+    return NodePool(**config)
+
 class EksWorker(core.Construct):
     def __init__(
         self,
@@ -24,10 +131,31 @@ class EksWorker(core.Construct):
         max_capacity: int,
         root_volume_size: int=20,
         kubelet_extra_args: typing.Optional[dict]=None,
+        labels: typing.Optional[dict]=None,
+        taints: typing.Optional[typing.List[str]]=None,
         rolling_update_pause_time: typing.Optional[core.Duration]=None,
         autoscaling_enabled: bool=True,
+        extra_instance_types: typing.Optional[typing.List[str]]=None,
+        on_demand_base_capacity: int=0,
+        spot_percentage: int=0,
+        kubelet_profile: typing.Optional[KubeletProfile]=None,
+        rolling_update: typing.Optional[RollingUpdate]=None,
     ) -> None:
         super().__init__(scope, id)
+        _validate_taints(taints)
+        if not 0 <= spot_percentage <= 100:
+            raise ValueError('spot_percentage must be between 0 and 100, got %d' % spot_percentage)
+        if not 0 <= on_demand_base_capacity <= max_capacity:
+            raise ValueError('on_demand_base_capacity must be between 0 and max_capacity, got %d' % on_demand_base_capacity)
+        mixed_instances = bool(extra_instance_types) or spot_percentage > 0
+        profile_args = _kubelet_profile_args(
+            profile=kubelet_profile,
+            cluster_version=cluster_version,
+            instance_types=[instance_type.to_string()] + list(extra_instance_types or []),
+        )
+        overlap = set(profile_args) & set(kubelet_extra_args or {})
+        if overlap:
+            raise ValueError('Kubelet args set by both the profile and kubelet_extra_args: %s' % ', '.join(sorted(overlap)))
 
         self.sg = aws_ec2.SecurityGroup(
             scope=self,
@@ -65,9 +193,15 @@ class EksWorker(core.Construct):
             id='node-role',
             cluster=cluster,
         )
+        rolling_update = rolling_update or RollingUpdate()
+        max_batch_size, min_instances_in_service = _rolling_update_sizes(
+            rolling_update=rolling_update,
+            min_capacity=min_capacity,
+            max_capacity=max_capacity,
+        )
         rolling_upgrade_config = aws_autoscaling.RollingUpdateConfiguration(
-            max_batch_size=1,
-            min_instances_in_service=1,
+            max_batch_size=max_batch_size,
+            min_instances_in_service=min_instances_in_service,
             pause_time=rolling_update_pause_time,
             suspend_processes=[
                 aws_autoscaling.ScalingProcess.AZ_REBALANCE,
@@ -95,9 +229,11 @@ class EksWorker(core.Construct):
                 region=region,
                 kubelet_extra_args=_kubelet_args_to_str(
                     name=name,
-                    labels={'aws-zone': zone},
-                    args=kubelet_extra_args
-                )
+                    labels=dict(labels or {}, **{'aws-zone': zone}),
+                    args=dict(profile_args, **(kubelet_extra_args or {})),
+                    taints=taints,
+                ),
+                use_max_pods='max-pods' not in profile_args,
             )
             asg = aws_autoscaling.AutoScalingGroup(
                 scope=self,
@@ -118,6 +254,25 @@ class EksWorker(core.Construct):
             asg.add_security_group(self.sg)
             _add_eks_owned_tag(asg, cluster)
 
+            if mixed_instances:
+                # Cluster autoscaler assumes every instance in a group has the
+                # shape of the first instance type, so the extra types should
+                # match its vCPU and memory.
+                _add_mixed_instances_policy(
+                    scope=self,
+                    id=f'launch-template-{index}',
+                    asg=asg,
+                    # asg.connections only knows the group's own security
+                    # group, not the ones added with add_security_group.
+                    security_groups=asg.connections.security_groups + [self.sg],
+                    image_id=ami.get_image(self).image_id,
+                    user_data=user_data,
+                    root_volume_size=root_volume_size,
+                    instance_types=[instance_type.to_string()] + list(extra_instance_types or []),
+                    on_demand_base_capacity=on_demand_base_capacity,
+                    spot_percentage=spot_percentage,
+                )
+
             # Cluster auto-scaling config
             core.Tag.add(
                 scope=asg,
@@ -131,19 +286,106 @@ class EksWorker(core.Construct):
                 value='true' if autoscaling_enabled else 'false',
                 apply_to_launched_instances=True,
             )
+            # Without parallel zones, each group waits for the previous
+            # zone to finish its update.
+            if self.asgs and not rolling_update.parallel_zones:
+                asg.node.add_dependency(self.asgs[-1])
             self.asgs.append(asg)
 
+def _rolling_update_sizes(
+    rolling_update: RollingUpdate,
+    min_capacity: int,
+    max_capacity: int,
+) -> typing.Tuple[int, int]:
+    batch = rolling_update.max_batch_percent
+    in_service = rolling_update.min_in_service_percent
+    for percent in (batch, in_service):
+        if not 0 <= percent <= 100:
+            raise ValueError('Rolling update percentages must be between 0 and 100, got %d' % percent)
+    if batch == 0:
+        raise ValueError('Rolling update needs max_batch_percent above 0')
+
+    max_batch_size = max(1, math.ceil(max_capacity * batch / 100))
+    min_instances_in_service = min_capacity * in_service // 100
+    return max_batch_size, max(0, min(min_instances_in_service, max_capacity - 1))
+
+def _add_mixed_instances_policy(
+    scope: core.Construct,
+    id: str,
+    asg: aws_autoscaling.AutoScalingGroup,
+    security_groups: typing.List[aws_ec2.ISecurityGroup],
+    image_id: str,
+    user_data: str,
+    root_volume_size: int,
+    instance_types: typing.List[str],
+    on_demand_base_capacity: int,
+    spot_percentage: int,
+) -> None:
+    # AutoScalingGroup only supports launch configurations, so the group is
+    # switched to a launch template with a mixed instances policy through
+    # overrides. The instance profile created for the group is reused.
+    instance_profile = asg.node.find_child('InstanceProfile')
+    launch_template = aws_ec2.CfnLaunchTemplate(
+        scope=scope,
+        id=id,
+        launch_template_data=aws_ec2.CfnLaunchTemplate.LaunchTemplateDataProperty(
+            image_id=image_id,
+            user_data=core.Fn.base64(user_data),
+            iam_instance_profile=aws_ec2.CfnLaunchTemplate.IamInstanceProfileProperty(
+                arn=instance_profile.attr_arn,
+            ),
+            security_group_ids=[
+                sg.security_group_id
+                for sg in security_groups
+            ],
+            block_device_mappings=[
+                aws_ec2.CfnLaunchTemplate.BlockDeviceMappingProperty(
+                    device_name='/dev/xvda',
+                    ebs=aws_ec2.CfnLaunchTemplate.EbsProperty(
+                        volume_size=root_volume_size,
+                        delete_on_termination=True,
+                    ),
+                ),
+            ],
+        ),
+    )
+
+    asg.node.try_remove_child('LaunchConfig')
+    cfn_asg = asg.node.default_child
+    cfn_asg.add_property_deletion_override('LaunchConfigurationName')
+    cfn_asg.add_property_override('MixedInstancesPolicy', {
+        'LaunchTemplate': {
+            'LaunchTemplateSpecification': {
+                'LaunchTemplateId': launch_template.ref,
+                'Version': launch_template.attr_latest_version_number,
+            },
+            'Overrides': [
+                {'InstanceType': instance_type}
+                for instance_type in instance_types
+            ],
+        },
+        'InstancesDistribution': {
+            'OnDemandAllocationStrategy': 'prioritized',
+            'OnDemandBaseCapacity': on_demand_base_capacity,
+            'OnDemandPercentageAboveBaseCapacity': 100 - spot_percentage,
+            'SpotAllocationStrategy': 'capacity-optimized',
+        },
+    })
+
 def _node_userdata(
     cluster: aws_eks.ICluster,
     stack_name: str,
     region: str,
     kubelet_extra_args: str,
+    use_max_pods: bool=True,
 ) -> str:
+        # bootstrap.sh sets max-pods from its own ENI table unless told not to.
+        bootstrap_args = '' if use_max_pods else ' --use-max-pods false'
         return f'''
 #!/bin/bash
 set -o xtrace
 /etc/eks/bootstrap.sh \
-    {cluster.cluster_name} \
+    {cluster.cluster_name}{bootstrap_args} \
     --kubelet-extra-args "{kubelet_extra_args}"
 /opt/aws/bin/cfn-signal --exit-code $? \
         --stack {stack_name} \
@@ -154,6 +396,7 @@ def _kubelet_args_to_str(
     name: str,
     labels: dict,
     args: dict,
+    taints: typing.Optional[typing.List[str]]=None,
 ) -> str:
     _labels = {
         f'node-role.kubernetes.io/{name}': '',
@@ -169,6 +412,9 @@ def _kubelet_args_to_str(
             separator=','
         ),
     }
+    if taints:
+        # Taints keep their given order.
+        _args['register-with-taints'] = ','.join(taints)
     if args:
         _args.update(args)
     
@@ -178,6 +424,115 @@ def _kubelet_args_to_str(
         separator=' ',
     )
 
+def _kubelet_profile_args(
+    profile: typing.Optional[KubeletProfile],
+    cluster_version: str,
+    instance_types: typing.List[str],
+) -> dict:
+    if profile is None:
+        return {}
+
+    args = {}
+    for flag, resources in (
+        ('kube-reserved', profile.kube_reserved),
+        ('system-reserved', profile.system_reserved),
+    ):
+        if not resources:
+            continue
+        for resource, quantity in resources.items():
+            if resource not in _reserved_resources:
+                raise ValueError('Unknown %s resource %r, expected one of %s' % (
+                    flag, resource, ', '.join(_reserved_resources),
+                ))
+            if not _quantity_pattern.match(str(quantity)):
+                raise ValueError('Invalid %s quantity %r for %s' % (flag, quantity, resource))
+        args[flag] = _dict_to_str(d=resources, kv_pattern='%s=%s', separator=',')
+
+    if profile.cpu_manager_policy not in _cpu_manager_policies:
+        raise ValueError('Unknown CPU manager policy %r' % profile.cpu_manager_policy)
+    if profile.cpu_manager_policy == 'static':
+        # The static policy only pins CPUs outside the reserved ones, and
+        # kubelet refuses to start without a CPU reservation.
+        if not any('cpu' in (r or {}) for r in (profile.kube_reserved, profile.system_reserved)):
+            raise ValueError('The static CPU manager policy needs kube_reserved or system_reserved cpu')
+        args['cpu-manager-policy'] = 'static'
+
+    if profile.topology_manager_policy is not None:
+        if profile.topology_manager_policy not in _topology_manager_policies:
+            raise ValueError('Unknown topology manager policy %r' % profile.topology_manager_policy)
+        if _version_tuple(cluster_version) < (1, 18):
+            raise ValueError('The topology manager needs Kubernetes 1.18 or newer, cluster is %s' % cluster_version)
+        args['topology-manager-policy'] = profile.topology_manager_policy
+
+    max_pods = profile.max_pods
+    if max_pods is None and profile.prefix_delegation:
+        unknown = [t for t in instance_types if t not in _eni_limits]
+        if unknown:
+            raise ValueError('Cannot size max_pods for prefix delegation on %s, set max_pods' % ', '.join(unknown))
+        max_pods = min(_prefix_delegation_max_pods(*_eni_limits[t]) for t in instance_types)
+    if max_pods is not None:
+        if max_pods < 1:
+            raise ValueError('max_pods must be positive, got %d' % max_pods)
+        args['max-pods'] = max_pods
+
+    high = profile.image_gc_high_threshold_percent
+    low = profile.image_gc_low_threshold_percent
+    for threshold in (high, low):
+        if threshold is not None and not 0 <= threshold <= 100:
+            raise ValueError('Image GC thresholds must be between 0 and 100, got %d' % threshold)
+    if high is not None and low is not None and low >= high:
+        raise ValueError('Image GC low threshold %d must be below the high threshold %d' % (low, high))
+    if high is not None:
+        args['image-gc-high-threshold'] = high
+    if low is not None:
+        args['image-gc-low-threshold'] = low
+
+    for flag, thresholds in (
+        ('eviction-hard', profile.eviction_hard),
+        ('eviction-soft', profile.eviction_soft),
+    ):
+        if not thresholds:
+            continue
+        for signal, threshold in thresholds.items():
+            if signal not in _eviction_signals:
+                raise ValueError('Unknown eviction signal %r, expected one of %s' % (
+                    signal, ', '.join(_eviction_signals),
+                ))
+            if not (_quantity_pattern.match(str(threshold)) or _percentage_pattern.match(str(threshold))):
+                raise ValueError('Invalid %s threshold %r for %s' % (flag, threshold, signal))
+        args[flag] = _dict_to_str(d=thresholds, kv_pattern='%s<%s', separator=',')
+
+    grace_periods = profile.eviction_soft_grace_period or {}
+    missing = set(profile.eviction_soft or {}) - set(grace_periods)
+    if missing:
+        raise ValueError('Soft eviction signals without a grace period: %s' % ', '.join(sorted(missing)))
+    for signal, period in grace_periods.items():
+        if signal not in (profile.eviction_soft or {}):
+            raise ValueError('Grace period for %r without a soft eviction threshold' % signal)
+        if not _duration_pattern.match(str(period)):
+            raise ValueError('Invalid grace period %r for %s' % (period, signal))
+    if grace_periods:
+        args['eviction-soft-grace-period'] = _dict_to_str(d=grace_periods, kv_pattern='%s=%s', separator=',')
+
+    return args
+
+def _prefix_delegation_max_pods(enis: int, ips_per_eni: int, vcpus: int) -> int:
+    # Every secondary IP slot holds a /28 prefix of 16 addresses. Kubernetes
+    # recommends at most 110 pods on small nodes and 250 on large ones.
+    max_pods = enis * (ips_per_eni - 1) * 16 + 2
+    return min(max_pods, 110 if vcpus < 30 else 250)
+
+def _version_tuple(version: str) -> tuple:
+    return tuple(int(part) for part in version.split('.')[:2])
+
+def _validate_taints(taints: typing.Optional[typing.List[str]]) -> None:
+    for taint in taints or []:
+        key_value, _, effect = taint.rpartition(':')
+        if not key_value.split('=', 1)[0] or effect not in _taint_effects:
+            raise ValueError('Invalid taint %r, expected key=value:Effect with Effect one of %s' % (
+                taint, ', '.join(_taint_effects),
+            ))
+
 def _dict_to_str(d: dict, kv_pattern: str, separator: str) -> str:
     elements = [
         kv_pattern % (k, v)
@@ -10,6 +10,7 @@ class EksNetworkStack(core.Stack):
         id: str,
         cidr_id: int,
         cluster_name: str,
+        max_azs: int=3,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
@@ -18,7 +19,7 @@ class EksNetworkStack(core.Stack):
             scope=self,
             id='eks',
             cidr='10.%d.0.0/16' % cidr_id,
-            max_azs=3,
+            max_azs=max_azs,
             subnet_configuration=[
                 aws_ec2.SubnetConfiguration(
                     name='public',
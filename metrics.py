@@ -0,0 +1,143 @@
+import atomic_file
+import contextlib
+import http.server
+import threading
+import time
+import typing
+
+_default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Minimal metric registry that renders the Prometheus text exposition format.
+# Metrics are identified by name and a sorted tuple of label pairs.
+class Registry:
+    def __init__(self, buckets: typing.Sequence[float]=_default_buckets) -> None:
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float=1, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.inc(name, time.monotonic() - start, **labels)
+
+    def instrument(self, client):
+        # Times every API call made by a boto3 client, including retries.
+        service = client.meta.service_model.service_id.hyphenize()
+        client.meta.events.register('before-call.%s' % service, self._before_call)
+        client.meta.events.register('after-call.%s' % service, self._after_call)
+        return client
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+                for name in sorted({name for name, _ in metrics}):
+                    lines.extend(self._header(name, kind))
+                    for (metric, labels), value in sorted(metrics.items()):
+                        if metric == name:
+                            lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.extend(self._header(name, 'histogram'))
+                for (metric, labels), (counts, total, count) in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        bucket_labels = labels + (('le', _format_value(bound)),)
+                        lines.append('%s_bucket%s %d' % (name, _format_labels(bucket_labels), bucket_count))
+                    lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', '+Inf'),)), count))
+                    lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(total)))
+                    lines.append('%s_count%s %d' % (name, _format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        # Collectors such as node_exporter usually run as a different user.
+        atomic_file.write(path, self.render(), mode=0o644)
+
+    def serve(self, port: int) -> http.server.HTTPServer:
+        registry = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.HTTPServer(('', port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def _header(self, name: str, kind: str) -> typing.List[str]:
+        lines = []
+        if name in self._help:
+            lines.append('# HELP %s %s' % (name, self._help[name]))
+        lines.append('# TYPE %s %s' % (name, kind))
+        return lines
+
+    def _before_call(self, context: dict, **kwargs) -> None:
+        context['metrics_start'] = time.monotonic()
+
+    def _after_call(self, event_name: str, context: dict, parsed: dict, **kwargs) -> None:
+        api = '.'.join(event_name.split('.', 2)[1:])
+        code = parsed.get('Error', {}).get('Code', 'OK')
+        self.inc('aws_api_calls_total', api=api, code=code)
+        start = context.get('metrics_start')
+        if start is not None:
+            self.observe('aws_api_call_duration_seconds', time.monotonic() - start, api=api)
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+default_registry = Registry()
+default_registry.describe('aws_api_calls_total', 'AWS API calls by API and response code.')
+default_registry.describe('aws_api_call_duration_seconds', 'AWS API call latency including retries.')
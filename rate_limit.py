@@ -0,0 +1,147 @@
+import collections
+import functools
+import random
+import threading
+import time
+import typing
+
+_throttle_codes = frozenset((
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'SlowDown',
+))
+
+# Token bucket whose refill rate adapts to the API: it is halved on every
+# throttle response and grows back additively on successful calls (AIMD).
+class TokenBucket:
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float=1.0,
+        max_rate: float=100.0,
+        increase: float=0.2,
+    ) -> None:
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate: float=10.0,
+        max_rate: float=100.0,
+        max_attempts: int=10,
+        base_delay: float=0.2,
+        max_delay: float=20.0,
+    ) -> None:
+        self.rate = rate
+        self.max_rate = max_rate
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {}
+        self._stats = collections.Counter()
+        self._lock = threading.Lock()
+
+    def bucket(self, api: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(api)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, max_rate=self.max_rate)
+                self._buckets[api] = bucket
+            return bucket
+
+    def instrument(self, client, scope: str=''):
+        # Handlers are attached to the client's event system, so paginators and
+        # botocore's own retries go through the limiter as well. The retry
+        # handler is registered first to take precedence over the default one.
+        # AWS quotas apply per account and often per region, so clients for
+        # different accounts or regions should be given different scopes to
+        # get buckets of their own.
+        service = client.meta.service_model.service_id.hyphenize()
+        client.meta.events.register('before-call.%s' % service, functools.partial(self._before_call, scope))
+        client.meta.events.register('before-send.%s' % service, functools.partial(self._before_send, scope))
+        client.meta.events.register_first('needs-retry.%s' % service, functools.partial(self._needs_retry, scope))
+        return client
+
+    def stats(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        result = {}
+        with self._lock:
+            for (api, stat), count in sorted(self._stats.items()):
+                result.setdefault(api, {})[stat] = count
+            for api, bucket in self._buckets.items():
+                result.setdefault(api, {})['rate'] = round(bucket.rate, 2)
+        return result
+
+    def _count(self, api: str, stat: str) -> None:
+        with self._lock:
+            self._stats[(api, stat)] += 1
+
+    def _before_call(self, scope: str, event_name: str, **kwargs) -> None:
+        self._count(_api_name(event_name, scope), 'calls')
+
+    def _before_send(self, scope: str, event_name: str, **kwargs) -> None:
+        self.bucket(_api_name(event_name, scope)).acquire()
+
+    def _needs_retry(
+        self,
+        scope: str,
+        event_name: str,
+        response=None,
+        attempts: int=1,
+        **kwargs,
+    ) -> typing.Optional[float]:
+        if response is None:
+            return None
+        api = _api_name(event_name, scope)
+        code = response[1].get('Error', {}).get('Code')
+        if code not in _throttle_codes:
+            if code is None:
+                self.bucket(api).on_success()
+            return None
+
+        self.bucket(api).on_throttle()
+        self._count(api, 'throttles')
+        if attempts >= self.max_attempts:
+            return None
+        self._count(api, 'retries')
+        # Full jitter keeps concurrent workers from retrying in lockstep.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempts))
+
+def _api_name(event_name: str, scope: str='') -> str:
+    _, service, operation = event_name.split('.', 2)
+    if scope:
+        return '%s.%s [%s]' % (service, operation, scope)
+    return '%s.%s' % (service, operation)
+
+default_limiter = RateLimiter()
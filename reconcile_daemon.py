@@ -0,0 +1,175 @@
+import http.server
+import json
+import queue
+import signal
+import threading
+import time
+import typing
+
+# In-process stand-in for an SQS queue, for local runs and tests.
+class LocalQueue:
+    def __init__(self) -> None:
+        self._queue = queue.Queue()
+
+    def send(self, body: str) -> None:
+        self._queue.put(body)
+
+    def receive(self, wait_seconds: float) -> list:
+        try:
+            messages = [self._queue.get(timeout=wait_seconds)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                messages.append(self._queue.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def delete(self, messages: list) -> None:
+        pass
+
+class SqsQueue:
+    def __init__(self, queue_url: str, client=None) -> None:
+        if client is None:
+            import boto3
+            client = boto3.client('sqs')
+        self._client = client
+        self._queue_url = queue_url
+
+    def receive(self, wait_seconds: float) -> list:
+        return self._client.receive_message(
+            QueueUrl=self._queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=max(0, min(20, int(wait_seconds))),
+        ).get('Messages', [])
+
+    def delete(self, messages: list) -> None:
+        if not messages:
+            return
+        self._client.delete_message_batch(
+            QueueUrl=self._queue_url,
+            Entries=[
+                {'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']}
+                for index, message in enumerate(messages)
+            ],
+        )
+
+class Daemon:
+    def __init__(
+        self,
+        reconcile: typing.Callable[[], None],
+        interval: float,
+        change_queue=None,
+        health_port: typing.Optional[int]=None,
+        debounce: float=2.0,
+        on_change: typing.Optional[typing.Callable[[list], None]]=None,
+    ) -> None:
+        self.reconcile = reconcile
+        self.on_change = on_change
+        self.interval = interval
+        self.change_queue = change_queue
+        self.health_port = health_port
+        self.debounce = debounce
+        self.reconciles = 0
+        self.last_success = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._health_server = None
+        self._pending_messages = []
+
+    def run(self) -> None:
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop())
+            signal.signal(signal.SIGINT, lambda *_: self.stop())
+        if self.health_port is not None:
+            self._start_health_server()
+
+        try:
+            while not self._stop.is_set():
+                self._reconcile()
+                self._wait_for_next_run()
+        finally:
+            if self._health_server is not None:
+                self._health_server.shutdown()
+                self._health_server.server_close()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def healthy(self) -> bool:
+        if self.last_success is None:
+            return False
+        # Allow for one slow run before reporting the daemon as stale.
+        return time.time() - self.last_success < 2 * self.interval + 60
+
+    def _reconcile(self) -> None:
+        try:
+            if self._pending_messages and self.on_change is not None:
+                self.on_change(self._pending_messages)
+            self.reconcile()
+        except Exception as e:
+            self.last_error = repr(e)
+            print('Reconcile failed:', e)
+        else:
+            self.last_success = time.time()
+            self.last_error = None
+            # Notifications are only acknowledged once they have been acted
+            # on. After a failed run they become visible again in the queue
+            # and trigger another run.
+            if self._pending_messages:
+                self.change_queue.delete(self._pending_messages)
+        self._pending_messages = []
+        self.reconciles += 1
+
+    def _wait_for_next_run(self) -> None:
+        deadline = time.monotonic() + self.interval
+        if self.change_queue is None:
+            self._stop.wait(self.interval)
+            return
+
+        # A notification ends the wait early. Messages arriving within the
+        # debounce window are folded into the same reconcile run.
+        while not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            messages = self.change_queue.receive(min(remaining, 20))
+            if messages:
+                if self._stop.wait(self.debounce):
+                    return
+                messages.extend(self.change_queue.receive(0))
+                self._pending_messages = messages
+                print('Received %d change notification(s)' % len(messages))
+                return
+
+    def _start_health_server(self) -> None:
+        daemon = self
+
+        class HealthHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/healthz':
+                    self.send_error(404)
+                    return
+                body = json.dumps({
+                    'healthy': daemon.healthy(),
+                    'reconciles': daemon.reconciles,
+                    'last_success': daemon.last_success,
+                    'last_error': daemon.last_error,
+                }).encode('utf-8')
+                self.send_response(200 if daemon.healthy() else 503)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._health_server = http.server.HTTPServer(
+            ('', self.health_port),
+            HealthHandler,
+        )
+        threading.Thread(
+            target=self._health_server.serve_forever,
+            daemon=True,
+        ).start()
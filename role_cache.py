@@ -0,0 +1,111 @@
+import atomic_file
+import json
+import time
+import typing
+
+# Snapshot of parsed role mappings keyed by IAM RoleId. Alongside the
+# per-role entries, an index of cluster -> RoleId -> mapping is maintained so
+# that refreshing a single role only touches the clusters it maps into.
+# With index_only, cached mappings are never reused, only the index of which
+# clusters a role is bound to.
+class RoleCache:
+    def __init__(
+        self,
+        path: typing.Optional[str]=None,
+        ttl: float=60 * 60,
+        max_entries: typing.Optional[int]=None,
+        index_only: bool=False,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index_only = index_only
+        self._roles = {}
+        self._clusters = {}
+
+    def load(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path) as fp:
+                roles = json.load(fp).get('roles', {})
+        except (OSError, ValueError):
+            return
+        for role_id, entry in roles.items():
+            self.update(role_id, entry['role_name'], entry['mappings'], entry['fetched_at'])
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        atomic_file.write(self.path, json.dumps({'roles': self._roles}, sort_keys=True))
+
+    def contains(self, role_id: str) -> bool:
+        return role_id in self._roles
+
+    def is_fresh(self, role_id: str, now: typing.Optional[float]=None) -> bool:
+        entry = self._roles.get(role_id)
+        if entry is None:
+            return False
+        return entry['fetched_at'] + self.ttl > (now or time.time())
+
+    def update(
+        self,
+        role_id: str,
+        role_name: str,
+        mappings: dict,
+        fetched_at: typing.Optional[float]=None,
+    ) -> None:
+        self._remove_from_clusters(role_id)
+        self._roles[role_id] = {
+            'role_name': role_name,
+            'mappings': mappings,
+            'fetched_at': fetched_at or time.time(),
+        }
+        for cluster, mapping in mappings.items():
+            self._clusters.setdefault(cluster, {})[role_id] = mapping
+
+    def remove(self, role_id: str) -> None:
+        self._remove_from_clusters(role_id)
+        self._roles.pop(role_id, None)
+
+    def invalidate(self, role_names: typing.Optional[typing.Collection[str]]=None) -> None:
+        # Invalidated roles are fetched again on the next run, whether or not
+        # they are bound to a targeted cluster.
+        for role_id, entry in list(self._roles.items()):
+            if role_names is None or entry['role_name'] in role_names:
+                self.remove(role_id)
+
+    def retain(self, role_ids: typing.Set[str]) -> None:
+        for role_id in list(self._roles):
+            if role_id not in role_ids:
+                self.remove(role_id)
+
+    def evict(self) -> None:
+        if self.max_entries is None or len(self._roles) <= self.max_entries:
+            return
+        by_age = sorted(self._roles, key=lambda r: self._roles[r]['fetched_at'])
+        for role_id in by_age[:len(self._roles) - self.max_entries]:
+            self.remove(role_id)
+
+    def role_ids_for_cluster(self, cluster: str) -> typing.Set[str]:
+        return set(self._clusters.get(cluster, {}))
+
+    def role_mappings(self) -> dict:
+        return {
+            cluster: [
+                roles[role_id]
+                for role_id in sorted(roles, key=lambda r: self._roles[r]['role_name'])
+            ]
+            for cluster, roles in sorted(self._clusters.items())
+            if roles
+        }
+
+    def _remove_from_clusters(self, role_id: str) -> None:
+        entry = self._roles.get(role_id)
+        if entry is None:
+            return
+        for cluster in entry['mappings']:
+            roles = self._clusters.get(cluster, {})
+            roles.pop(role_id, None)
+            if not roles:
+                self._clusters.pop(cluster, None)
@@ -0,0 +1,56 @@
+import atomic_file
+import hashlib
+import json
+import threading
+import time
+import typing
+
+# On-disk record of the desired-state hash and outcome of each cluster in a
+# rollout. The file is rewritten after every change, so a rollout that dies
+# halfway can be resumed from the clusters that are still pending or failed.
+# Once every cluster succeeded the journal is cleared, so the next rollout
+# reads every cluster again and repairs drift.
+class Journal:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._clusters = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        try:
+            with open(self.path) as fp:
+                self._clusters = json.load(fp).get('clusters', {})
+        except (OSError, ValueError):
+            self._clusters = {}
+
+    def is_done(self, cluster, desired_hash: str) -> bool:
+        with self._lock:
+            entry = self._clusters.get(str(cluster))
+        return entry is not None and entry['status'] == 'ok' and entry['hash'] == desired_hash
+
+    def record(
+        self,
+        cluster,
+        desired_hash: str,
+        status: str,
+        error: typing.Optional[str]=None,
+    ) -> None:
+        with self._lock:
+            self._clusters[str(cluster)] = {
+                'hash': desired_hash,
+                'status': status,
+                'error': error,
+                'updated_at': time.time(),
+            }
+            self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clusters = {}
+            self._save()
+
+    def _save(self) -> None:
+        atomic_file.write(self.path, json.dumps({'clusters': self._clusters}, indent=2, sort_keys=True))
+
+def desired_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
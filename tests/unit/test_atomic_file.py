@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+import atomic_file
+
+def test_write_replaces_file(tmp_path):
+    path = str(tmp_path / 'state.json')
+    atomic_file.write(path, 'old')
+    atomic_file.write(path, b'new')
+
+    with open(path) as fp:
+        assert fp.read() == 'new'
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.listdir(str(tmp_path)) == ['state.json']
+
+def test_failed_write_leaves_no_temp_file(tmp_path):
+    path = str(tmp_path / 'state.json')
+    atomic_file.write(path, 'keep')
+
+    with pytest.raises(OSError):
+        atomic_file.write(str(tmp_path), 'cannot replace a directory')
+
+    assert os.listdir(str(tmp_path)) == ['state.json']
@@ -0,0 +1,111 @@
+import base64
+import os
+
+import pytest
+
+import eks_client
+
+_ca = b'-----BEGIN CERTIFICATE-----\nfake\n-----END CERTIFICATE-----\n'
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(eks_client, '_cache_dir', str(tmp_path))
+    return tmp_path
+
+def test_ca_cert_is_written_to_private_dir(cache_dir):
+    path = eks_client._save_eks_ca_cert(base64.b64encode(_ca).decode())
+
+    with open(path, 'rb') as fp:
+        assert fp.read() == _ca
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+
+def test_tampered_ca_cert_is_replaced(cache_dir):
+    path = eks_client._save_eks_ca_cert(base64.b64encode(_ca).decode())
+    with open(path, 'wb') as fp:
+        fp.write(b'attacker CA')
+
+    assert eks_client._save_eks_ca_cert(base64.b64encode(_ca).decode()) == path
+    with open(path, 'rb') as fp:
+        assert fp.read() == _ca
+
+def test_shared_ca_dir_is_rejected(cache_dir):
+    ca_dir = cache_dir / 'eks-client-ca'
+    ca_dir.mkdir(mode=0o777)
+    os.chmod(str(ca_dir), 0o777)
+
+    with pytest.raises(RuntimeError):
+        eks_client._save_eks_ca_cert(base64.b64encode(_ca).decode())
+
+def test_token_cache_is_keyed_by_credentials(tmp_path, monkeypatch):
+    signed = []
+
+    def generate_token(cluster, role_arn, region):
+        signed.append(os.environ['AWS_ACCESS_KEY_ID'])
+        return 'token-%d' % len(signed)
+
+    monkeypatch.setattr(eks_client, '_generate_token', generate_token)
+    monkeypatch.setattr(eks_client, '_token_cache_path', str(tmp_path / 'tokens.json'))
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'AKIAFIRST')
+
+    first = eks_client._get_file_cached_token('demo', None, None, 0)
+    assert eks_client._get_file_cached_token('demo', None, None, 0) == first
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'AKIASECOND')
+    second = eks_client._get_file_cached_token('demo', None, None, 0)
+
+    assert second != first
+    assert signed == ['AKIAFIRST', 'AKIASECOND']
+    with open(str(tmp_path / 'tokens.json')) as fp:
+        assert 'AKIA' not in fp.read()
+
+@pytest.fixture
+def clusters(cache_dir, monkeypatch):
+    infos = {
+        'cluster-a': eks_client.ClusterInfo('https://a.example.com', base64.b64encode(b'ca-a').decode(), 0),
+        'cluster-b': eks_client.ClusterInfo('https://b.example.com', base64.b64encode(b'ca-b').decode(), 0),
+    }
+    monkeypatch.setattr(eks_client, 'get_cluster_info', lambda cluster, role_arn=None, region=None: infos[cluster])
+    monkeypatch.setattr(eks_client, 'get_token', lambda cluster, role_arn=None, region=None: 'token-for-' + cluster)
+    monkeypatch.setattr(eks_client, '_api_clients', {})
+    yield infos
+    eks_client.close()
+
+def test_clients_send_their_own_cluster_token(clusters):
+    pytest.importorskip('kubernetes')
+    client_a = eks_client.for_cluster('cluster-a')
+    client_b = eks_client.for_cluster('cluster-b')
+
+    assert client_a.configuration.get_api_key_with_prefix('authorization') == 'Bearer token-for-cluster-a'
+    assert client_b.configuration.get_api_key_with_prefix('authorization') == 'Bearer token-for-cluster-b'
+    assert eks_client.for_cluster('cluster-a') is client_a
+    assert client_a.configuration.get_api_key_with_prefix('authorization') == 'Bearer token-for-cluster-a'
+
+def test_client_is_rebuilt_for_recreated_cluster(clusters):
+    pytest.importorskip('kubernetes')
+    client = eks_client.for_cluster('cluster-a')
+    clusters['cluster-a'] = eks_client.ClusterInfo('https://a2.example.com', base64.b64encode(b'ca-a2').decode(), 1)
+
+    rebuilt = eks_client.for_cluster('cluster-a')
+
+    assert rebuilt is not client
+    assert rebuilt.configuration.host == 'https://a2.example.com'
+    with open(rebuilt.configuration.ssl_ca_cert, 'rb') as fp:
+        assert fp.read() == b'ca-a2'
+
+def test_exec_credential(monkeypatch):
+    monkeypatch.setattr(eks_client, '_tokens', {})
+    monkeypatch.setattr(eks_client, '_token_cache_path', None)
+    monkeypatch.setattr(eks_client, '_generate_token', lambda cluster, role_arn, region: 'k8s-aws-v1.token')
+    monkeypatch.setattr(eks_client.time, 'time', lambda: 1600000000.0)
+
+    credential = eks_client.exec_credential('demo', api_version='client.authentication.k8s.io/v1')
+
+    assert credential == {
+        'kind': 'ExecCredential',
+        'apiVersion': 'client.authentication.k8s.io/v1',
+        'spec': {},
+        'status': {
+            # Signed at 12:26:40 UTC, valid for 15 minutes, renewed a minute early.
+            'expirationTimestamp': '2020-09-13T12:40:40Z',
+            'token': 'k8s-aws-v1.token',
+        },
+    }
@@ -0,0 +1,233 @@
+import json
+import os
+import re
+import sys
+import tempfile
+
+import pytest
+import yaml
+
+_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_account = '123456789012'
+_region = 'eu-central-1'
+
+# The jsii runtime reads the context when it starts, so the AZ lookup has to
+# be seeded before the CDK is imported.
+os.environ['CDK_CONTEXT_JSON'] = json.dumps({
+    'availability-zones:account=%s:region=%s' % (_account, _region): ['eu-central-1a', 'eu-central-1b', 'eu-central-1c'],
+})
+sys.path.insert(0, os.path.join(_root, 'infra'))
+core = pytest.importorskip('aws_cdk.core')
+
+import eks_worker
+import infra.eks
+import infra.network
+
+def _synth(node_pools):
+    env = core.Environment(account=_account, region=_region)
+    app = core.App(outdir=tempfile.mkdtemp())
+    network_stack = infra.network.EksNetworkStack(
+        scope=app,
+        id='test-network',
+        cidr_id=100,
+        cluster_name='test',
+        env=env,
+    )
+    infra.eks.EksStack(
+        scope=app,
+        id='test-eks',
+        cluster_name='test',
+        cluster_version='1.14',
+        vpc=network_stack.vpc,
+        node_pools=node_pools,
+        env=env,
+    )
+    return app.synth().get_stack('test-eks').template['Resources']
+
+def _resources(resources, type, prefix):
+    return {
+        logical_id: resource
+        for logical_id, resource in resources.items()
+        if resource['Type'] == type and logical_id.startswith(prefix)
+    }
+
+def _user_data(resource):
+    properties = resource['Properties']
+    if resource['Type'] == 'AWS::EC2::LaunchTemplate':
+        properties = properties['LaunchTemplateData']
+    parts = properties['UserData']['Fn::Base64']['Fn::Join'][1]
+    return ''.join(part for part in parts if isinstance(part, str))
+
+def test_asgs_per_pool_and_zone():
+    resources = _synth([
+        eks_worker.NodePool(name='default', ingress=True),
+        eks_worker.NodePool(name='batch', min_capacity=0, max_capacity=3),
+    ])
+
+    default_asgs = _resources(resources, 'AWS::AutoScaling::AutoScalingGroup', 'defaultnodes')
+    batch_asgs = _resources(resources, 'AWS::AutoScaling::AutoScalingGroup', 'batchnodes')
+    assert len(default_asgs) == 3
+    assert len(batch_asgs) == 3
+    for asg in batch_asgs.values():
+        assert asg['Properties']['MinSize'] == '0'
+        assert asg['Properties']['MaxSize'] == '3'
+    # Only ingress pools are registered with the load balancers.
+    assert all(asg['Properties'].get('LoadBalancerNames') for asg in default_asgs.values())
+    assert not any(asg['Properties'].get('LoadBalancerNames') for asg in batch_asgs.values())
+
+def test_bootstrap_args_carry_labels_and_taints():
+    resources = _synth([
+        eks_worker.NodePool(name='default', ingress=True),
+        eks_worker.NodePool(
+            name='gpu',
+            labels={'accelerator': 'nvidia'},
+            taints=['nvidia.com/gpu=true:NoSchedule', 'dedicated=gpu:NoExecute'],
+        ),
+    ])
+
+    launch_configs = _resources(resources, 'AWS::AutoScaling::LaunchConfiguration', 'gpunodes')
+    zones = set()
+    for launch_config in launch_configs.values():
+        user_data = _user_data(launch_config)
+        assert '--register-with-taints=nvidia.com/gpu=true:NoSchedule,dedicated=gpu:NoExecute' in user_data
+        assert 'accelerator=nvidia' in user_data
+        assert 'node-role.kubernetes.io/gpu=' in user_data
+        zones.update(zone for zone in ('eu-central-1a', 'eu-central-1b', 'eu-central-1c') if 'aws-zone=' + zone in user_data)
+    assert zones == {'eu-central-1a', 'eu-central-1b', 'eu-central-1c'}
+
+def test_requires_an_ingress_pool():
+    with pytest.raises(ValueError, match='ingress'):
+        _synth([eks_worker.NodePool(name='default')])
+
+def test_mixed_instances_launch_template_keeps_node_security_group():
+    resources = _synth([
+        eks_worker.NodePool(name='default', ingress=True),
+        eks_worker.NodePool(name='spot', extra_instance_types=['t3a.large'], spot_percentage=75),
+    ])
+
+    node_sg, = _resources(resources, 'AWS::EC2::SecurityGroup', 'spotnodessg')
+    launch_templates = _resources(resources, 'AWS::EC2::LaunchTemplate', 'spotnodes')
+    assert len(launch_templates) == 3
+    for launch_template in launch_templates.values():
+        group_ids = launch_template['Properties']['LaunchTemplateData']['SecurityGroupIds']
+        refs = [group_id['Fn::GetAtt'][0] for group_id in group_ids]
+        assert node_sg in refs
+        assert any(ref.startswith('spotnodesasg') and 'InstanceSecurityGroup' in ref for ref in refs)
+    assert not _resources(resources, 'AWS::AutoScaling::LaunchConfiguration', 'spotnodes')
+
+def _rolling_updates(resources, prefix):
+    return [
+        asg['UpdatePolicy']['AutoScalingRollingUpdate']
+        for asg in _resources(resources, 'AWS::AutoScaling::AutoScalingGroup', prefix).values()
+    ]
+
+def test_rolling_update_policy():
+    resources = _synth([
+        eks_worker.NodePool(name='default', min_capacity=2, max_capacity=10, ingress=True),
+        eks_worker.NodePool(
+            name='batch',
+            min_capacity=4,
+            max_capacity=8,
+            rolling_update=eks_worker.RollingUpdate(max_batch_percent=50, min_in_service_percent=50),
+        ),
+    ])
+
+    for policy in _rolling_updates(resources, 'defaultnodes'):
+        assert policy['MaxBatchSize'] == 3
+        assert policy['MinInstancesInService'] == 2
+        assert policy['SuspendProcesses'] == ['AZRebalance']
+    for policy in _rolling_updates(resources, 'batchnodes'):
+        assert policy['MaxBatchSize'] == 4
+        assert policy['MinInstancesInService'] == 2
+
+def test_rolling_update_policy_single_node():
+    resources = _synth([
+        eks_worker.NodePool(name='default', min_capacity=1, max_capacity=1, ingress=True),
+    ])
+
+    # MinInstancesInService has to stay below MaxSize.
+    for policy in _rolling_updates(resources, 'defaultnodes'):
+        assert policy['MaxBatchSize'] == 1
+        assert policy['MinInstancesInService'] == 0
+
+def test_rolling_update_zones_in_sequence():
+    resources = _synth([
+        eks_worker.NodePool(
+            name='default',
+            ingress=True,
+            rolling_update=eks_worker.RollingUpdate(parallel_zones=False),
+        ),
+    ])
+
+    asgs = _resources(resources, 'AWS::AutoScaling::AutoScalingGroup', 'defaultnodes')
+    first, second, third = sorted(asgs)
+    assert 'DependsOn' not in asgs[first]
+    assert first in asgs[second]['DependsOn']
+    assert second in asgs[third]['DependsOn']
+
+def _documented_node_pools():
+    # The node pool examples in clusters.yaml are commented out. Their lines
+    # are indented further than the prose around them.
+    with open(os.path.join(_root, 'clusters.yaml')) as fp:
+        lines = [line[1:] for line in fp if re.match(r'^#\s{3,}\S', line)]
+    return yaml.safe_load(''.join(lines))['node_pools']
+
+def test_documented_node_pools_synthesize():
+    pools = _documented_node_pools()
+    assert [pool['name'] for pool in pools] == ['default', 'batch']
+    assert pools[1]['kubelet_profile']['prefix_delegation']
+
+    resources = _synth([eks_worker.node_pool_from_config(pool) for pool in pools])
+
+    launch_templates = _resources(resources, 'AWS::EC2::LaunchTemplate', 'batchnodes')
+    assert len(launch_templates) == 3
+    for launch_template in launch_templates.values():
+        user_data = _user_data(launch_template)
+        for flag in (
+            '--kube-reserved=cpu=250m,memory=1Gi',
+            '--system-reserved=cpu=250m,memory=500Mi',
+            '--cpu-manager-policy=static',
+            # 4 ENIs with 14 prefixes each, capped at 110 pods below 30 vCPUs
+            '--max-pods=110',
+            '--image-gc-high-threshold=85',
+            '--image-gc-low-threshold=70',
+            '--eviction-hard=memory.available<500Mi,nodefs.available<10%',
+            '--register-with-taints=dedicated=batch:NoSchedule',
+        ):
+            assert flag in user_data
+        # bootstrap.sh must not override the computed max-pods.
+        assert ' --use-max-pods false ' in user_data
+
+    for launch_config in _resources(resources, 'AWS::AutoScaling::LaunchConfiguration', 'defaultnodes').values():
+        user_data = _user_data(launch_config)
+        assert '--use-max-pods' not in user_data
+        assert '--max-pods' not in user_data
+
+@pytest.mark.parametrize('profile, error', [
+    (
+        eks_worker.KubeletProfile(cpu_manager_policy='static', kube_reserved={'memory': '1Gi'}),
+        'static CPU manager policy',
+    ),
+    (
+        eks_worker.KubeletProfile(image_gc_high_threshold_percent=70, image_gc_low_threshold_percent=70),
+        'low threshold',
+    ),
+    (
+        eks_worker.KubeletProfile(eviction_soft={'memory.available': '1Gi'}),
+        'without a grace period',
+    ),
+    (
+        eks_worker.KubeletProfile(prefix_delegation=True),
+        'Cannot size max_pods',
+    ),
+])
+def test_invalid_kubelet_profile(profile, error):
+    with pytest.raises(ValueError, match=error):
+        _synth([
+            eks_worker.NodePool(
+                name='default',
+                instance_type='t3a.large',
+                ingress=True,
+                kubelet_profile=profile,
+            ),
+        ])
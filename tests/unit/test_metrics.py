@@ -0,0 +1,14 @@
+import os
+
+import metrics
+
+def test_write_is_world_readable(tmp_path):
+    registry = metrics.Registry()
+    registry.inc('runs_total')
+    path = str(tmp_path / 'update_aws_auth.prom')
+
+    registry.write(path)
+
+    assert os.stat(path).st_mode & 0o777 == 0o644
+    with open(path) as fp:
+        assert 'runs_total 1' in fp.read()
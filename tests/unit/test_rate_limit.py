@@ -0,0 +1,70 @@
+import types
+
+import boto3
+
+import rate_limit
+
+def _throttled():
+    return (types.SimpleNamespace(status_code=400, headers={}), {'Error': {'Code': 'Throttling'}, 'ResponseMetadata': {}})
+
+def _ok():
+    return (types.SimpleNamespace(status_code=200, headers={}), {'ResponseMetadata': {}})
+
+def _client(limiter: rate_limit.RateLimiter, scope: str):
+    client = boto3.session.Session(
+        aws_access_key_id='test',
+        aws_secret_access_key='test',
+        region_name='us-east-1',
+    ).client('iam')
+    return limiter.instrument(client, scope)
+
+def _needs_retry(client, response, attempts: int=1):
+    results = client.meta.events.emit(
+        'needs-retry.iam.ListRoles',
+        response=response,
+        endpoint=None,
+        operation=None,
+        attempts=attempts,
+        caught_exception=None,
+        request_dict={},
+    )
+    return next((r for _, r in results if r is not None), None)
+
+def test_bucket_backs_off_and_recovers():
+    bucket = rate_limit.TokenBucket(8.0, min_rate=1.0, max_rate=9.0, increase=0.5)
+
+    bucket.on_throttle()
+    assert bucket.rate == 4.0
+    for _ in range(5):
+        bucket.on_throttle()
+    assert bucket.rate == 1.0
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rate == 9.0
+
+def test_throttled_call_is_retried_with_backoff():
+    limiter = rate_limit.RateLimiter(rate=10.0, max_attempts=3, base_delay=0.1)
+    client = _client(limiter, 'account-a')
+
+    delay = _needs_retry(client, _throttled(), attempts=1)
+    assert 0 <= delay <= 0.2
+    assert _needs_retry(client, _ok()) is None
+    # After max_attempts the limiter leaves the decision to botocore.
+    _needs_retry(client, _throttled(), attempts=3)
+
+    stats = limiter.stats()['iam.ListRoles [account-a]']
+    assert stats['throttles'] == 2
+    assert stats['retries'] == 1
+
+def test_buckets_are_scoped():
+    limiter = rate_limit.RateLimiter(rate=10.0)
+    throttled = _client(limiter, 'arn:aws:iam::111111111111:role/a')
+    other = _client(limiter, 'arn:aws:iam::222222222222:role/b')
+
+    _needs_retry(throttled, _throttled())
+
+    assert limiter.bucket('iam.ListRoles [arn:aws:iam::111111111111:role/a]').rate == 5.0
+    assert limiter.bucket('iam.ListRoles [arn:aws:iam::222222222222:role/b]').rate == 10.0
+    assert limiter.stats()['iam.ListRoles [arn:aws:iam::111111111111:role/a]']['throttles'] == 1
+    assert 'throttles' not in limiter.stats()['iam.ListRoles [arn:aws:iam::222222222222:role/b]']
+    assert other is not throttled
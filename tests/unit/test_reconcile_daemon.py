@@ -0,0 +1,59 @@
+import reconcile_daemon
+
+class RecordingQueue(reconcile_daemon.LocalQueue):
+    def __init__(self) -> None:
+        super().__init__()
+        self.deleted = []
+
+    def delete(self, messages: list) -> None:
+        self.deleted.extend(messages)
+
+def _daemon(reconcile, change_queue):
+    return reconcile_daemon.Daemon(
+        reconcile=reconcile,
+        interval=60,
+        change_queue=change_queue,
+        debounce=0,
+    )
+
+def test_messages_are_deleted_after_successful_run():
+    change_queue = RecordingQueue()
+    daemon = _daemon(lambda: None, change_queue)
+    change_queue.send('changed')
+
+    daemon._wait_for_next_run()
+    assert change_queue.deleted == []
+    daemon._reconcile()
+
+    assert change_queue.deleted == ['changed']
+
+def test_messages_are_kept_after_failed_run():
+    def reconcile():
+        raise RuntimeError('boom')
+
+    change_queue = RecordingQueue()
+    daemon = _daemon(reconcile, change_queue)
+    change_queue.send('changed')
+
+    daemon._wait_for_next_run()
+    daemon._reconcile()
+
+    assert change_queue.deleted == []
+    assert daemon.last_error == "RuntimeError('boom')"
+
+def test_on_change_sees_notifications_before_the_run():
+    calls = []
+    change_queue = RecordingQueue()
+    daemon = reconcile_daemon.Daemon(
+        reconcile=lambda: calls.append('reconcile'),
+        interval=60,
+        change_queue=change_queue,
+        debounce=0,
+        on_change=lambda messages: calls.append(messages),
+    )
+    change_queue.send('changed')
+
+    daemon._wait_for_next_run()
+    daemon._reconcile()
+
+    assert calls == [['changed'], 'reconcile']
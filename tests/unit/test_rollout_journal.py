@@ -0,0 +1,34 @@
+import rollout_journal
+
+def test_journal_survives_reload(tmp_path):
+    path = str(tmp_path / 'journal.json')
+    journal = rollout_journal.Journal(path)
+    journal.record('cluster-a', 'hash-1', 'ok')
+    journal.record('cluster-b', 'hash-1', 'pending')
+    journal.record('cluster-c', 'hash-1', 'failed', 'boom')
+
+    reloaded = rollout_journal.Journal(path)
+    reloaded.load()
+
+    assert reloaded.is_done('cluster-a', 'hash-1')
+    assert not reloaded.is_done('cluster-a', 'hash-2')
+    assert not reloaded.is_done('cluster-b', 'hash-1')
+    assert not reloaded.is_done('cluster-c', 'hash-1')
+
+def test_clear(tmp_path):
+    path = str(tmp_path / 'journal.json')
+    journal = rollout_journal.Journal(path)
+    journal.record('cluster-a', 'hash-1', 'ok')
+    journal.clear()
+
+    reloaded = rollout_journal.Journal(path)
+    reloaded.load()
+    assert not reloaded.is_done('cluster-a', 'hash-1')
+
+def test_unreadable_journal_starts_empty(tmp_path):
+    path = tmp_path / 'journal.json'
+    path.write_text('not json')
+    journal = rollout_journal.Journal(str(path))
+    journal.load()
+
+    assert not journal.is_done('cluster-a', 'hash-1')
@@ -0,0 +1,223 @@
+import importlib.util
+import json
+import os
+
+import role_cache
+import rollout_journal
+from benchmarks import fakes
+
+_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _load_update_aws_auth():
+    spec = importlib.util.spec_from_file_location(
+        'update_aws_auth',
+        os.path.join(_root, 'update-aws-auth.py'),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+update_aws_auth = _load_update_aws_auth()
+
+def _both_paths(iam: fakes.FakeIam, clusters=None):
+    bulk = update_aws_auth.generate_role_mappings_bulk(
+        '123456789012',
+        update_aws_auth.fetch_roles_with_tags(iam),
+        clusters=clusters,
+    )
+    per_role = update_aws_auth.generate_role_mappings(
+        '123456789012',
+        update_aws_auth.fetch_roles(iam),
+        4,
+        iam,
+        clusters=clusters,
+    )
+    return bulk, per_role
+
+def test_bulk_matches_per_role():
+    # Roles cycle through node, compact user and legacy per-cluster tags.
+    iam = fakes.FakeIam(role_count=30, cluster_count=5)
+    bulk, per_role = _both_paths(iam)
+
+    assert bulk == per_role
+    assert sorted(bulk) == iam.clusters
+    assert iam.calls['ListRoleTags'] == 30
+
+def test_bulk_matches_per_role_with_paginated_tags():
+    # 40 legacy bindings are 120 tags, more than one ListRoleTags page.
+    iam = fakes.FakeIam(role_count=6, cluster_count=40, bindings_per_role=40)
+    bulk, per_role = _both_paths(iam)
+
+    assert bulk == per_role
+    assert iam.calls['ListRoleTags'] > 6
+    legacy = 'arn:aws:iam::123456789012:role/role-2'
+    assert all(
+        any(m['rolearn'] == legacy for m in bulk[cluster])
+        for cluster in iam.clusters
+    )
+
+def test_legacy_tags_override_compact_tags():
+    iam = fakes.FakeIam(role_count=1, cluster_count=1)
+    iam.tags['role-0'] = [
+        {'Key': 'eks-user/username', 'Value': 'compact'},
+        {'Key': 'eks-user/groups', 'Value': 'a,b'},
+        {'Key': 'eks-user/clusters', 'Value': 'cluster-0 cluster-1'},
+        {'Key': 'eks/cluster-1/type', 'Value': 'user'},
+        {'Key': 'eks/cluster-1/username', 'Value': 'legacy'},
+        {'Key': 'eks/cluster-1/groups', 'Value': 'c'},
+    ]
+    bulk, per_role = _both_paths(iam)
+
+    assert bulk == per_role
+    assert bulk['cluster-0'][0]['username'] == 'compact'
+    assert bulk['cluster-0'][0]['groups'] == ['a', 'b']
+    assert bulk['cluster-1'][0]['username'] == 'legacy'
+    assert bulk['cluster-1'][0]['groups'] == ['c']
+
+def test_bulk_matches_per_role_for_selected_clusters():
+    iam = fakes.FakeIam(role_count=30, cluster_count=5)
+    bulk, per_role = _both_paths(iam, clusters=['cluster-1', 'cluster-3'])
+
+    assert bulk == per_role
+    assert sorted(bulk) == ['cluster-1', 'cluster-3']
+
+def _notification(role_name: str) -> dict:
+    return {'Body': json.dumps({'detail': {'requestParameters': {'roleName': role_name}}})}
+
+def test_changed_role_names():
+    sns = {'Body': json.dumps({'Message': _notification('role-2')['Body']})}
+
+    assert update_aws_auth.changed_role_names([_notification('role-1'), sns]) == {'role-1', 'role-2'}
+    assert update_aws_auth.changed_role_names([_notification('role-1'), {'Body': 'not json'}]) is None
+
+def test_notified_role_is_refetched_from_cache():
+    iam = fakes.FakeIam(role_count=6, cluster_count=3, bindings_per_role=1)
+    cache = role_cache.RoleCache()
+    update_aws_auth.generate_role_mappings_cached('123456789012', update_aws_auth.fetch_roles(iam), cache, iam_client=iam)
+    arn = 'arn:aws:iam::123456789012:role/role-1'
+    assert any(m['rolearn'] == arn for m in cache.role_mappings()['cluster-1'])
+
+    iam.tags['role-1'] = fakes._role_tags(1, ['cluster-0'])
+    cache.invalidate(update_aws_auth.changed_role_names([_notification('role-1')]))
+    iam.calls.clear()
+    mappings = update_aws_auth.generate_role_mappings_cached(
+        '123456789012',
+        update_aws_auth.fetch_roles(iam),
+        cache,
+        iam_client=iam,
+        clusters=['cluster-0'],
+    )
+
+    assert iam.calls['ListRoleTags'] == 1
+    assert any(m['rolearn'] == arn for m in mappings['cluster-0'])
+    assert not any(m['rolearn'] == arn for m in cache.role_mappings().get('cluster-1', []))
+
+def test_cluster_targeting_keeps_roles_under_other_paths():
+    iam = fakes.FakeIam(role_count=3, cluster_count=2, bindings_per_role=2)
+    iam.roles[0]['Path'] = '/eks/admins/'
+    iam.roles[1]['Path'] = '/eks/clusters/cluster-1/'
+    iam.roles[2]['Path'] = '/eks/clusters/cluster-0/'
+    bulk, per_role = _both_paths(iam, clusters=['cluster-0'])
+
+    assert bulk == per_role
+    assert sorted(m['rolearn'].rsplit('/', 1)[1] for m in bulk['cluster-0']) == ['role-0', 'role-2']
+    # The role scoped to cluster-1 is skipped without reading its tags.
+    assert iam.calls['ListRoleTags'] == 2
+
+def _by_arn(role_mappings: dict) -> dict:
+    return {
+        cluster: sorted(mappings, key=lambda m: m['rolearn'])
+        for cluster, mappings in role_mappings.items()
+    }
+
+def test_cache_eviction_keeps_all_mappings():
+    iam = fakes.FakeIam(role_count=30, cluster_count=5)
+    cache = role_cache.RoleCache(max_entries=10)
+    expected = update_aws_auth.generate_role_mappings('123456789012', update_aws_auth.fetch_roles(iam), 4, iam)
+
+    for _ in range(2):
+        cached = update_aws_auth.generate_role_mappings_cached(
+            '123456789012',
+            update_aws_auth.fetch_roles(iam),
+            cache,
+            iam_client=iam,
+        )
+        assert _by_arn(cached) == _by_arn(expected)
+        assert sum(cache.contains(role['RoleId']) for role in iam.roles) == 10
+
+def test_role_index_skips_roles_bound_to_other_clusters(tmp_path):
+    iam = fakes.FakeIam(role_count=30, cluster_count=5, bindings_per_role=1)
+    path = str(tmp_path / 'role-index.json')
+    expected = update_aws_auth.generate_role_mappings(
+        '123456789012',
+        update_aws_auth.fetch_roles(iam),
+        4,
+        iam,
+        clusters=['cluster-0'],
+    )
+
+    for run in range(2):
+        index = role_cache.RoleCache(path=path, index_only=True)
+        index.load()
+        iam.calls.clear()
+        mappings = update_aws_auth.generate_role_mappings_cached(
+            '123456789012',
+            update_aws_auth.fetch_roles(iam),
+            index,
+            iam_client=iam,
+            clusters=['cluster-0'],
+        )
+
+        assert _by_arn(mappings) == _by_arn(expected)
+    # Only the six roles bound to cluster-0 are read again.
+    assert iam.calls['ListRoleTags'] == 6
+
+    iam.tags['role-1'] = fakes._role_tags(1, ['cluster-0'])
+    index = role_cache.RoleCache(path=path, ttl=0, index_only=True)
+    index.load()
+    mappings = update_aws_auth.generate_role_mappings_cached(
+        '123456789012',
+        update_aws_auth.fetch_roles(iam),
+        index,
+        iam_client=iam,
+        clusters=['cluster-0'],
+    )
+    # Expired index entries are checked again.
+    assert any(m['rolearn'].endswith('/role-1') for m in mappings['cluster-0'])
+
+def test_journal_resumes_and_is_cleared_after_rollout(tmp_path, monkeypatch):
+    written = []
+    failing = {'cluster-1'}
+
+    def update_aws_auth_cm(client, mappings, timeout):
+        if client in failing:
+            raise RuntimeError('unreachable')
+        written.append(client)
+        return True
+
+    monkeypatch.setattr(update_aws_auth, 'update_aws_auth_cm', update_aws_auth_cm)
+    role_mappings = update_aws_auth.generate_role_mappings_bulk(
+        '123456789012',
+        update_aws_auth.fetch_roles_with_tags(fakes.FakeIam(role_count=6, cluster_count=3)),
+    )
+    path = str(tmp_path / 'journal.json')
+
+    def rollout():
+        written.clear()
+        journal = rollout_journal.Journal(path)
+        journal.load()
+        return update_aws_auth.update_aws_auth(role_mappings, connect=lambda cluster: cluster, journal=journal)
+
+    results = rollout()
+    assert sorted(written) == ['cluster-0', 'cluster-2']
+    assert [r.cluster for r in results if r.error is not None] == ['cluster-1']
+
+    # Clusters that succeeded are skipped and the failed one is retried.
+    failing.clear()
+    results = rollout()
+    assert written == ['cluster-1']
+    assert [r.cluster for r in results if r.skipped] == ['cluster-0', 'cluster-2']
+
+    # The completed rollout is forgotten, so drift in any cluster is repaired.
+    rollout()
+    assert sorted(written) == ['cluster-0', 'cluster-1', 'cluster-2']
@@ -1,42 +1,205 @@
 #!/usr/bin/env python3
 
 import re
+import os
+import sys
+import json
+import time
 import argparse
-import boto3
+import collections
+import contextlib
+import concurrent.futures
+import typing
 import yaml
-import kubernetes
 import eks_client
+import metrics
+import rate_limit
+import reconcile_daemon
+import role_cache
+import rollout_journal
 
-_eks_role_type_pattern = re.compile(r'^eks/(\w+)/type$')
-_iam_client = boto3.client('iam')
-_sts_client = boto3.client('sts')
+_eks_role_type_pattern = re.compile(r'^eks/([\w-]+)/type$')
+# Kubernetes rejects ConfigMaps whose data exceeds 1 MiB.
+_config_map_max_bytes = 1024 * 1024
+_cluster_scoped_path = '/eks/clusters/'
+_default_role_index = '~/.cache/update-aws-auth/role-index.json'
+# The libyaml based loader and dumper are much faster when available.
+_yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_yaml_dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+_metrics = metrics.default_registry
+
+_metrics.describe('update_aws_auth_phase_seconds_total', 'Time spent per phase, summed over workers.')
+_metrics.describe('update_aws_auth_cluster_phase_seconds', 'Duration of the last connect/write per cluster.')
+_metrics.describe('update_aws_auth_cluster_phase_duration_seconds', 'Cluster connect/write latency.')
+_metrics.describe('update_aws_auth_cluster_updates_total', 'Cluster updates by result.')
+_metrics.describe('update_aws_auth_last_run_duration_seconds', 'Wall time of the last run.')
+_metrics.describe('update_aws_auth_last_run_timestamp_seconds', 'Unix time the last run finished.')
+
+# Clients are created on first use through eks_client, which shares the
+# session, rate limiter and metrics. The kubernetes package is only imported
+# by the functions that talk to clusters, so dry runs never load it.
+def _iam_client():
+    return eks_client.client_for('iam')
+
+def _sts_client():
+    return eks_client.client_for('sts')
 
 def get_account_id() -> str:
-    return _sts_client.get_caller_identity()['Account']
+    with _metrics.timer('update_aws_auth_phase_seconds_total', phase='sts'):
+        return _sts_client().get_caller_identity()['Account']
+
+def fetch_roles(iam_client=None):
+    paginator = (iam_client or _iam_client()).get_paginator('list_roles')
+    return _timed_pages(paginator.paginate(PathPrefix='/eks/'))
 
-def fetch_roles():
-    paginator = _iam_client.get_paginator('list_roles')
-    return paginator.paginate(PathPrefix='/eks/')
+def fetch_roles_with_tags(iam_client=None):
+    paginator = (iam_client or _iam_client()).get_paginator('get_account_authorization_details')
+    for page in _timed_pages(paginator.paginate(Filter=['Role'])):
+        yield [
+            role
+            for role in page.get('RoleDetailList', [])
+            if role['Path'].startswith('/eks/')
+        ]
 
-def generate_role_mappings(account_id: str, roles_output) -> dict:
+def _timed_pages(pages):
+    # Only the time spent waiting for the next page counts as listing time.
+    pages = iter(pages)
+    while True:
+        with _metrics.timer('update_aws_auth_phase_seconds_total', phase='iam_list'):
+            page = next(pages, None)
+        if page is None:
+            return
+        yield page
+
+def generate_role_mappings_bulk(
+    account_id: str,
+    roles_output,
+    clusters: typing.Optional[typing.Collection[str]]=None,
+) -> dict:
     all_mappings = {}
 
     for roles in roles_output:
-        for role in roles.get('Roles', []):
-            mappings = create_mappings(account_id, role)
-            for cluster, mapping in mappings.items():
-                l = all_mappings.get(cluster, [])
-                l.append(mapping)
-                all_mappings[cluster] = l
+        for role in roles:
+            if not _role_in_scope(role, clusters):
+                continue
+            with _metrics.timer('update_aws_auth_phase_seconds_total', phase='mapping_generation'):
+                mappings = parse_mappings(account_id, role, role.get('Tags', []))
+            _add_mappings(all_mappings, mappings)
+
+    return _select_clusters(all_mappings, clusters)
+
+def generate_role_mappings(
+    account_id: str,
+    roles_output,
+    concurrency: int=10,
+    iam_client=None,
+    clusters: typing.Optional[typing.Collection[str]]=None,
+) -> dict:
+    all_mappings = {}
+
+    # Tag lookups are submitted while the role pages are still being fetched.
+    # Results are collected in submission order to keep the output stable.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(create_mappings, account_id, role, iam_client)
+            for roles in roles_output
+            for role in roles.get('Roles', [])
+            if _role_in_scope(role, clusters)
+        ]
+        for future in futures:
+            _add_mappings(all_mappings, future.result())
+
+    return _select_clusters(all_mappings, clusters)
+
+def generate_role_mappings_cached(
+    account_id: str,
+    roles_output,
+    cache: role_cache.RoleCache,
+    concurrency: int=10,
+    iam_client=None,
+    clusters: typing.Optional[typing.Collection[str]]=None,
+) -> dict:
+    now = time.time()
+    seen = set()
+
+    # When targeting clusters, roles that were recently found to be bound
+    # only to other clusters are skipped.
+    relevant = None
+    if clusters:
+        relevant = set()
+        for cluster in clusters:
+            relevant.update(cache.role_ids_for_cluster(cluster))
+
+    # Only roles that are new or whose cached entry has expired are fetched,
+    # or every role in scope when the cache is only used as an index. Roles
+    # that no longer exist are dropped from the cache afterwards.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        for roles in roles_output:
+            for role in roles.get('Roles', []):
+                role_id = role['RoleId']
+                seen.add(role_id)
+                if not _role_in_scope(role, clusters):
+                    continue
+                fresh = cache.is_fresh(role_id, now)
+                if relevant is not None and fresh and role_id not in relevant:
+                    continue
+                if fresh and not cache.index_only:
+                    continue
+                futures.append((role, executor.submit(create_mappings, account_id, role, iam_client)))
+        for role, future in futures:
+            cache.update(role['RoleId'], role['RoleName'], future.result(), now)
+
+    cache.retain(seen)
+    # The mappings are taken before evicting, since max_entries only limits
+    # what is kept for the next run. Evicted roles are fetched again then.
+    role_mappings = _select_clusters(cache.role_mappings(), clusters)
+    cache.evict()
+    cache.save()
+    return role_mappings
+
+def _role_in_scope(role: dict, clusters: typing.Optional[typing.Collection[str]]) -> bool:
+    # Roles under /eks/clusters/<cluster>/ declare that they are bound to that
+    # cluster only, so they can be skipped without looking at their tags when
+    # targeting other clusters. Any other path says nothing about the binding.
+    if not clusters or not role['Path'].startswith(_cluster_scoped_path):
+        return True
+    return role['Path'][len(_cluster_scoped_path):].split('/', 1)[0] in clusters
 
-    return all_mappings
+def _select_clusters(
+    role_mappings: dict,
+    clusters: typing.Optional[typing.Collection[str]],
+) -> dict:
+    if not clusters:
+        return role_mappings
+    return {
+        cluster: mappings
+        for cluster, mappings in role_mappings.items()
+        if cluster in clusters
+    }
+
+def _add_mappings(all_mappings: dict, mappings: dict) -> None:
+    for cluster, mapping in mappings.items():
+        l = all_mappings.get(cluster, [])
+        l.append(mapping)
+        all_mappings[cluster] = l
 
-def create_mappings(account_id: str, role: dict) -> dict:
+def create_mappings(account_id: str, role: dict, iam_client=None) -> dict:
+    iam_client = iam_client or _iam_client()
+    kwargs = {'RoleName': role['RoleName'], 'MaxItems': 100}
+    tags = []
+    with _metrics.timer('update_aws_auth_phase_seconds_total', phase='tag_fetch'):
+        while True:
+            output = iam_client.list_role_tags(**kwargs)
+            tags.extend(output.get('Tags', []))
+            if not output.get('IsTruncated'):
+                break
+            kwargs['Marker'] = output['Marker']
+    with _metrics.timer('update_aws_auth_phase_seconds_total', phase='mapping_generation'):
+        return parse_mappings(account_id, role, tags)
+
+def parse_mappings(account_id: str, role: dict, tags: list) -> dict:
     arn = 'arn:aws:iam::%s:role/%s' % (account_id, role['RoleName'])
-    tags = _iam_client.list_role_tags(
-        RoleName=role['RoleName'],
-        MaxItems=100,
-    ).get('Tags', [])
     tags = {
         tag['Key']: tag['Value']
         for tag in tags
@@ -48,7 +211,18 @@ def create_mappings(account_id: str, role: dict) -> dict:
         if match:
             clusters.append(match[1])
     
+    # Compact bindings list the clusters in a few space separated tag values
+    # and share a single username and group list between them.
     mappings = {}
+    for cluster in _compact_clusters(tags, 'eks-user/clusters'):
+        mappings[cluster] = {
+            'rolearn': arn,
+            'username': tags['eks-user/username'],
+            'groups': tags['eks-user/groups'].split(','),
+        }
+    for cluster in _compact_clusters(tags, 'eks-node/clusters'):
+        mappings[cluster] = _node_mapping(arn)
+
     for cluster in clusters:
         role_type = tags['eks/%s/type' % cluster]
         if role_type == 'user':
@@ -58,47 +232,325 @@ def create_mappings(account_id: str, role: dict) -> dict:
                 'groups': tags['eks/%s/groups' % cluster].split(',')
             }
         elif role_type == 'node':
-            mappings[cluster] = {
-                'rolearn': arn,
-                'username': 'system:node:{{EC2PrivateDNSName}}',
-                'groups': ['system:bootstrappers', 'system:nodes'],
-            }
+            mappings[cluster] = _node_mapping(arn)
         else:
             raise ValueError('Unexpected role type: %s' % role_type)
 
     return mappings
 
-def update_aws_auth(role_mappings: dict) -> None:
+def _compact_clusters(tags: dict, key: str) -> typing.List[str]:
+    return [
+        cluster
+        for tag_key in sorted(tags)
+        if tag_key == key or tag_key.startswith(key + '/')
+        for cluster in tags[tag_key].split()
+    ]
+
+def _node_mapping(arn: str) -> dict:
+    return {
+        'rolearn': arn,
+        'username': 'system:node:{{EC2PrivateDNSName}}',
+        'groups': ['system:bootstrappers', 'system:nodes'],
+    }
+
+class ClusterTarget(collections.namedtuple(
+    'ClusterTarget',
+    ['account_id', 'region', 'name', 'role_arn'],
+)):
+    def __str__(self) -> str:
+        return '%s/%s/%s' % (self.account_id, self.region, self.name)
+
+AccountResult = collections.namedtuple(
+    'AccountResult',
+    ['role_arn', 'account_id', 'roles', 'clusters', 'error', 'duration'],
+)
+
+def discover_fleet(
+    role_arns: typing.List[str],
+    regions: typing.List[str],
+    bulk: bool=False,
+    concurrency: int=10,
+    clusters: typing.Optional[typing.Collection[str]]=None,
+) -> typing.Tuple[dict, list]:
+    plan = {}
+    results = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(role_arns)) as executor:
+        futures = [
+            executor.submit(_discover_account, role_arn, regions, bulk, concurrency, clusters)
+            for role_arn in role_arns
+        ]
+        for future in futures:
+            result, account_plan = future.result()
+            plan.update(account_plan)
+            results.append(result)
+
+    return dict(sorted(plan.items(), key=lambda i: str(i[0]))), results
+
+def _discover_account(
+    role_arn: str,
+    regions: typing.List[str],
+    bulk: bool,
+    concurrency: int,
+    clusters: typing.Optional[typing.Collection[str]],
+) -> typing.Tuple[AccountResult, dict]:
+    start = time.monotonic()
+    try:
+        account_id = eks_client.client_for('sts', role_arn).get_caller_identity()['Account']
+        iam_client = eks_client.client_for('iam', role_arn)
+
+        # Cluster listing in each region overlaps with the IAM role discovery.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(regions)) as executor:
+            cluster_futures = {
+                region: executor.submit(eks_client.list_clusters, role_arn, region)
+                for region in regions
+            }
+            if bulk:
+                roles = fetch_roles_with_tags(iam_client)
+                role_mappings = generate_role_mappings_bulk(account_id, roles, clusters)
+            else:
+                roles = fetch_roles(iam_client)
+                role_mappings = generate_role_mappings(account_id, roles, concurrency, iam_client, clusters)
+            region_clusters = {
+                region: future.result()
+                for region, future in cluster_futures.items()
+            }
+    except Exception as e:
+        return AccountResult(role_arn, None, 0, 0, e, time.monotonic() - start), {}
+
+    plan = {
+        ClusterTarget(account_id, region, name, role_arn): role_mappings[name]
+        for region, names in region_clusters.items()
+        for name in names
+        if name in role_mappings
+    }
+    role_count = len({m['rolearn'] for mappings in role_mappings.values() for m in mappings})
+    result = AccountResult(role_arn, account_id, role_count, len(plan), None, time.monotonic() - start)
+    return result, plan
+
+def print_discovery_summary(results: list) -> None:
+    print('Discovery summary:')
+    for r in results:
+        if r.error is not None:
+            print('  %s: failed (%.2fs): %s' % (r.role_arn, r.duration, r.error))
+        else:
+            print('  %s: %d roles, %d clusters (%.2fs)' % (r.account_id, r.roles, r.clusters, r.duration))
+
+ClusterResult = collections.namedtuple(
+    'ClusterResult',
+    ['cluster', 'changed', 'error', 'duration', 'skipped'],
+)
+
+def update_aws_auth(
+    role_mappings: dict,
+    concurrency: int=10,
+    timeout: float=30.0,
+    connect: typing.Optional[typing.Callable]=None,
+    journal: typing.Optional[rollout_journal.Journal]=None,
+) -> list:
+    connect = connect or _connect
+    results = []
+
+    # Clusters the journal already records at the desired state are skipped.
+    # The rest are marked pending first, so an interrupted rollout resumes
+    # from them.
+    pending = {}
     for cluster, mappings in role_mappings.items():
-        client = eks_client.for_cluster(cluster)
-        update_aws_auth_cm(client, mappings)
-        print('Updated AWS auth for cluster: ', cluster)
+        desired_hash = None
+        if journal is not None:
+            desired_hash = rollout_journal.desired_hash(serialize_mappings(mappings))
+            if journal.is_done(cluster, desired_hash):
+                results.append(ClusterResult(cluster, False, None, 0.0, True))
+                continue
+            journal.record(cluster, desired_hash, 'pending')
+        pending[cluster] = (mappings, desired_hash)
 
-def update_aws_auth_cm(client: kubernetes.client.ApiClient, mappings: dict) -> None:
-    v1 = kubernetes.client.CoreV1Api(client)
-    body = kubernetes.client.V1ConfigMap(
-        metadata={
-            'name': 'aws-auth',
-        },
-        data={
-            'mapRoles': yaml.dump(mappings)
+    # Each cluster is connected to and updated in its own worker, so a slow
+    # or unreachable API server only holds up its own slot.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(_update_cluster, cluster, mappings, timeout, connect): desired_hash
+            for cluster, (mappings, desired_hash) in pending.items()
         }
-    )
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            if journal is not None:
+                journal.record(
+                    result.cluster,
+                    futures[future],
+                    'ok' if result.error is None else 'failed',
+                    None if result.error is None else str(result.error),
+                )
+            if result.error is None and result.changed:
+                print('Updated AWS auth for cluster: ', result.cluster)
+            elif result.error is None:
+                print('AWS auth already up to date for cluster: ', result.cluster)
+            else:
+                print('Failed to update AWS auth for cluster: ', result.cluster, result.error)
+            results.append(result)
+
+    if journal is not None and all(r.error is None for r in results):
+        journal.clear()
+    results.sort(key=lambda r: str(r.cluster))
+    return results
+
+def _update_cluster(
+    cluster,
+    mappings: list,
+    timeout: float,
+    connect: typing.Callable,
+) -> ClusterResult:
+    start = time.monotonic()
+    try:
+        with _cluster_phase(cluster, 'connect'):
+            client = connect(cluster)
+        with _cluster_phase(cluster, 'write'):
+            changed = update_aws_auth_cm(client, mappings, timeout)
+    except Exception as e:
+        _metrics.inc('update_aws_auth_cluster_updates_total', result='failed')
+        return ClusterResult(cluster, False, e, time.monotonic() - start, False)
+    _metrics.inc('update_aws_auth_cluster_updates_total', result='updated' if changed else 'unchanged')
+    return ClusterResult(cluster, changed, None, time.monotonic() - start, False)
+
+@contextlib.contextmanager
+def _cluster_phase(cluster, phase: str):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - start
+        _metrics.set('update_aws_auth_cluster_phase_seconds', duration, cluster=cluster, phase=phase)
+        _metrics.observe('update_aws_auth_cluster_phase_duration_seconds', duration, phase=phase)
+
+def _connect(cluster) -> 'kubernetes.client.ApiClient':
+    if isinstance(cluster, ClusterTarget):
+        return eks_client.for_cluster(cluster.name, cluster.role_arn, cluster.region)
+    return eks_client.for_cluster(cluster)
+
+def print_rollout_summary(results: list) -> None:
+    failed = [r for r in results if r.error is not None]
+    updated = [r for r in results if r.error is None and r.changed]
+    skipped = [r for r in results if r.skipped]
+    print('Rollout summary:')
+    for r in results:
+        status = 'failed' if r.error else 'updated' if r.changed else 'skipped' if r.skipped else 'unchanged'
+        print('  %s: %s (%.2fs)' % (r.cluster, status, r.duration))
+    print('%d updated, %d unchanged, %d skipped, %d failed' % (
+        len(updated),
+        len(results) - len(updated) - len(skipped) - len(failed),
+        len(skipped),
+        len(failed),
+    ))
+
+def update_aws_auth_cm(
+    client: 'kubernetes.client.ApiClient',
+    mappings: list,
+    timeout: typing.Optional[float]=None,
+) -> bool:
+    import kubernetes
+
+    v1 = kubernetes.client.CoreV1Api(client)
+    desired = normalize_mappings(mappings)
+    map_roles = serialize_mappings(desired)
 
     try:
-        _ = v1.read_namespaced_config_map(name='aws-auth', namespace='kube-system')
-        v1.replace_namespaced_config_map(name='aws-auth', namespace='kube-system', body=body)
+        current = v1.read_namespaced_config_map(
+            name='aws-auth',
+            namespace='kube-system',
+            _request_timeout=timeout,
+        )
     except kubernetes.client.rest.ApiException as e:
-        if e.status == 404:
-            v1.create_namespaced_config_map(namespace='kube-system', body=body)
-        else:
+        if e.status != 404:
             raise
+        _check_config_map_size({'mapRoles': map_roles})
+        body = kubernetes.client.V1ConfigMap(
+            metadata={
+                'name': 'aws-auth',
+            },
+            data={
+                'mapRoles': map_roles
+            }
+        )
+        v1.create_namespaced_config_map(
+            namespace='kube-system',
+            body=body,
+            _request_timeout=timeout,
+        )
+        return True
+
+    current_data = current.data or {}
+    current_mappings = yaml.load(current_data.get('mapRoles') or '[]', Loader=_yaml_loader)
+    if normalize_mappings(current_mappings or []) == desired:
+        return False
+    _check_config_map_size(dict(current_data, mapRoles=map_roles))
+
+    # Only mapRoles is patched, so the other keys (mapUsers, mapAccounts) are
+    # left untouched. Including the resourceVersion makes the API server
+    # reject the patch if the ConfigMap changed since it was read.
+    body = {
+        'metadata': {
+            'resourceVersion': current.metadata.resource_version,
+        },
+        'data': {
+            'mapRoles': map_roles,
+        },
+    }
+    v1.patch_namespaced_config_map(
+        name='aws-auth',
+        namespace='kube-system',
+        body=body,
+        _request_timeout=timeout,
+    )
+    return True
+
+def normalize_mappings(mappings: list) -> list:
+    normalized = [
+        dict(mapping, groups=sorted(set(mapping.get('groups') or [])))
+        for mapping in mappings
+    ]
+    normalized.sort(key=lambda m: (m.get('rolearn', ''), m.get('username', '')))
+    return normalized
+
+def serialize_mappings(mappings: list) -> str:
+    mappings = normalize_mappings(mappings)
+
+    # Mappings with the same groups share one list object, which the dumper
+    # writes once as an anchor and refers to with aliases afterwards.
+    groups = {}
+    for mapping in mappings:
+        mapping['groups'] = groups.setdefault(tuple(mapping['groups']), mapping['groups'])
+
+    return yaml.dump(
+        mappings,
+        Dumper=_yaml_dumper,
+        default_flow_style=False,
+        sort_keys=True,
+    )
+
+def _check_config_map_size(data: dict) -> None:
+    size = sum(len(k.encode('utf-8')) + len(v.encode('utf-8')) for k, v in data.items())
+    if size > _config_map_max_bytes:
+        raise ValueError('aws-auth ConfigMap would be %d bytes, limit is %d' % (
+            size,
+            _config_map_max_bytes,
+        ))
+
+def print_rate_limit_summary() -> None:
+    print('AWS API calls:')
+    for api, stats in rate_limit.default_limiter.stats().items():
+        print('  %s: %d calls, %d throttles, %d retries, %.2f req/s' % (
+            api,
+            stats.get('calls', 0),
+            stats.get('throttles', 0),
+            stats.get('retries', 0),
+            stats.get('rate', 0),
+        ))
 
 def print_role_mappings(role_mappings):
     for cluster, mappings in role_mappings.items():
         print('EKS cluster:', cluster)
         print('Role mappings:')
-        print(yaml.dump(mappings))
+        print(serialize_mappings(mappings))
         print('')
 
 def main() -> None:
@@ -111,17 +563,252 @@ def main() -> None:
         action='store_true',
         help='Update clusters instead of printing the AWS auth details',
     )
+    aparser.add_argument(
+        '--concurrency',
+        dest='concurrency',
+        type=int,
+        default=10,
+        help='Maximum number of concurrent IAM role tag lookups',
+    )
+    aparser.add_argument(
+        '--bulk',
+        dest='bulk',
+        action='store_true',
+        help='Discover roles and their tags using GetAccountAuthorizationDetails',
+    )
+    aparser.add_argument(
+        '--cluster-concurrency',
+        dest='cluster_concurrency',
+        type=int,
+        default=10,
+        help='Maximum number of clusters to update in parallel',
+    )
+    aparser.add_argument(
+        '--timeout',
+        dest='timeout',
+        type=float,
+        default=30.0,
+        help='Kubernetes API request timeout in seconds',
+    )
+    aparser.add_argument(
+        '--daemon',
+        dest='daemon',
+        action='store_true',
+        help='Keep running and reconcile clusters periodically',
+    )
+    aparser.add_argument(
+        '--interval',
+        dest='interval',
+        type=float,
+        default=300.0,
+        help='Seconds between reconcile runs in daemon mode',
+    )
+    aparser.add_argument(
+        '--queue-url',
+        dest='queue_url',
+        help='SQS queue for role change notifications in daemon mode',
+    )
+    aparser.add_argument(
+        '--health-port',
+        dest='health_port',
+        type=int,
+        help='Port for the /healthz endpoint in daemon mode',
+    )
+    aparser.add_argument(
+        '--cache-file',
+        dest='cache_file',
+        help='File for caching role mappings between runs',
+    )
+    aparser.add_argument(
+        '--cache-ttl',
+        dest='cache_ttl',
+        type=float,
+        default=60 * 60,
+        help='Seconds before cached role mappings are fetched again',
+    )
+    aparser.add_argument(
+        '--cache-max-entries',
+        dest='cache_max_entries',
+        type=int,
+        help='Maximum number of roles kept in the role mapping cache',
+    )
+    aparser.add_argument(
+        '--account-role',
+        dest='account_roles',
+        action='append',
+        default=[],
+        help='Role ARN to assume for discovering an account (repeatable)',
+    )
+    aparser.add_argument(
+        '--region',
+        dest='regions',
+        action='append',
+        default=[],
+        help='Region to discover clusters in with --account-role (repeatable)',
+    )
+    aparser.add_argument(
+        '--metrics-file',
+        dest='metrics_file',
+        help='Write Prometheus metrics to this file after each run',
+    )
+    aparser.add_argument(
+        '--metrics-port',
+        dest='metrics_port',
+        type=int,
+        help='Serve Prometheus metrics on this port at /metrics',
+    )
+    aparser.add_argument(
+        '--cluster',
+        dest='clusters',
+        action='append',
+        default=[],
+        help='Only discover and update this cluster (repeatable)',
+    )
+    aparser.add_argument(
+        '--role-index',
+        dest='role_index',
+        default=os.path.expanduser(_default_role_index),
+        help='File recording which clusters each role is bound to, used with --cluster and without --cache-file',
+    )
+    aparser.add_argument(
+        '--journal',
+        dest='journal',
+        help='Rollout journal file used to resume interrupted or partly failed updates; cleared once every cluster succeeded',
+    )
     args = aparser.parse_args()
 
-    account_id = get_account_id()
-    roles = fetch_roles()
-    role_mappings = generate_role_mappings(account_id, roles)
+    if args.metrics_port is not None:
+        _metrics.serve(args.metrics_port)
+
+    cache = None
+    if args.cache_file or args.daemon:
+        cache = role_cache.RoleCache(
+            path=args.cache_file,
+            ttl=args.cache_ttl,
+            max_entries=args.cache_max_entries,
+        )
+    elif args.clusters:
+        # Most roles are not under /eks/clusters/<cluster>/, so the tags are
+        # the only way to tell which clusters they are bound to. The index
+        # remembers that between runs, while the mappings for the targeted
+        # clusters are still read from IAM every time.
+        cache = role_cache.RoleCache(
+            path=args.role_index,
+            ttl=args.cache_ttl,
+            max_entries=args.cache_max_entries,
+            index_only=True,
+        )
+    if cache is not None:
+        cache.load()
+
+    if not args.daemon:
+        if not run(args, cache=cache):
+            sys.exit(1)
+        return
+
+    account_id = None if args.account_roles else get_account_id()
+
+    def reconcile() -> None:
+        if not run(args, account_id, cache):
+            raise RuntimeError('Failed to update some clusters')
+
+    def on_change(messages: list) -> None:
+        # Cached tags would hide the change that was just announced.
+        if cache is not None:
+            cache.invalidate(changed_role_names(messages))
+
+    change_queue = None
+    if args.queue_url:
+        change_queue = reconcile_daemon.SqsQueue(args.queue_url)
+    reconcile_daemon.Daemon(
+        reconcile=reconcile,
+        interval=args.interval,
+        change_queue=change_queue,
+        health_port=args.health_port,
+        on_change=on_change,
+    ).run()
+    eks_client.close()
+
+def changed_role_names(messages: list) -> typing.Optional[typing.Set[str]]:
+    # Notifications are CloudTrail events for IAM role changes, delivered
+    # directly or wrapped by SNS. When a message does not name a role, every
+    # role has to be considered changed.
+    role_names = set()
+    for message in messages:
+        body = message.get('Body') if isinstance(message, dict) else message
+        try:
+            event = json.loads(body)
+            if isinstance(event.get('Message'), str):
+                event = json.loads(event['Message'])
+            role_names.add(event['detail']['requestParameters']['roleName'])
+        except (TypeError, ValueError, KeyError, AttributeError):
+            return None
+    return role_names
+
+def run(
+    args: argparse.Namespace,
+    account_id: typing.Optional[str]=None,
+    cache: typing.Optional[role_cache.RoleCache]=None,
+) -> bool:
+    start = time.monotonic()
+    ok = True
+    if args.account_roles:
+        role_mappings, account_results = discover_fleet(
+            args.account_roles,
+            args.regions or [eks_client.session_for().region_name],
+            args.bulk,
+            args.concurrency,
+            args.clusters,
+        )
+        print_discovery_summary(account_results)
+        ok = all(r.error is None for r in account_results)
+    elif args.bulk:
+        account_id = account_id or get_account_id()
+        roles = fetch_roles_with_tags()
+        role_mappings = generate_role_mappings_bulk(account_id, roles, args.clusters)
+    elif cache is not None:
+        account_id = account_id or get_account_id()
+        roles = fetch_roles()
+        role_mappings = generate_role_mappings_cached(
+            account_id,
+            roles,
+            cache,
+            args.concurrency,
+            clusters=args.clusters,
+        )
+    else:
+        account_id = account_id or get_account_id()
+        roles = fetch_roles()
+        role_mappings = generate_role_mappings(
+            account_id,
+            roles,
+            args.concurrency,
+            clusters=args.clusters,
+        )
     
     print_role_mappings(role_mappings)
     if args.update:
-        update_aws_auth(role_mappings)
+        journal = None
+        if args.journal:
+            journal = rollout_journal.Journal(args.journal)
+            journal.load()
+        results = update_aws_auth(
+            role_mappings,
+            args.cluster_concurrency,
+            args.timeout,
+            journal=journal,
+        )
+        print_rollout_summary(results)
+        ok = ok and all(r.error is None for r in results)
     else:
         print('Skipping update')
+    print_rate_limit_summary()
+
+    _metrics.set('update_aws_auth_last_run_duration_seconds', time.monotonic() - start)
+    _metrics.set('update_aws_auth_last_run_timestamp_seconds', time.time())
+    if args.metrics_file:
+        _metrics.write(args.metrics_file)
+    return ok
 
 if __name__ == '__main__':
     main()